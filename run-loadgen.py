@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import sys
+
+if sys.version_info.major <= 2:
+
+    sys.exit("Error: 'CodeBank' requires Python 3.5 and above to run correctly.")
+
+import argparse
+
+parser = argparse.ArgumentParser( prog="CodeBank Load Generator" )
+
+parser.add_argument('host', help="Address of the server")
+parser.add_argument('-p', '--port', action='store', type=int, default=None, help="Port number of the server")
+parser.add_argument('-c', '--clients', action='store', type=int, default=10, help="Number of simulated performers")
+parser.add_argument('-r', '--rate', action='store', type=float, default=1.0, help="Average number of actions per second for each performer")
+parser.add_argument('-d', '--duration', action='store', type=float, default=10.0, help="Number of seconds to run for")
+parser.add_argument('-m', '--mode', action='store', default="foxdot", help="Name of the interpreter used by the server e.g. FoxDot")
+parser.add_argument('--password', action='store', default="", help="Server password")
+parser.add_argument('--mix', action='store', default=None, help="Relative weight of each action e.g. push=1,edit=4,release=1,chat=1,typing=2")
+
+args = parser.parse_args()
+
+from src.interpreter import get_interpreter
+from src.utils import SERVER_PORT_NUMER
+from src.client.loadgen import LoadGenerator
+
+lang = get_interpreter(args.mode)
+
+if lang is None:
+
+    sys.exit("FatalError: '{}' is not a valid interpreter.".format(args.mode))
+
+mix = None
+
+if args.mix is not None:
+
+    mix = dict((key, float(value)) for key, value in (item.split("=") for item in args.mix.split(",")))
+
+loadgen = LoadGenerator(args.host, args.port if args.port is not None else SERVER_PORT_NUMER,
+                        clients=args.clients, rate=args.rate, duration=args.duration,
+                        password=args.password, lang_id=lang.get_id(), mix=mix)
+
+print(loadgen.run().report())
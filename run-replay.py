@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import sys
+
+if sys.version_info.major <= 2:
+
+    sys.exit("Error: 'CodeBank' requires Python 3.5 and above to run correctly.")
+
+import argparse
+
+parser = argparse.ArgumentParser( prog="CodeBank Session Replay" )
+
+parser.add_argument('recording', help="Recording made with 'run-server.py --record'")
+parser.add_argument('-m', '--mode', action='store', default=None, help="Name of interpreter e.g. FoxDot (defaults to the one used in the recording)")
+parser.add_argument('-s', '--speed', action='store', type=float, default=1.0, help="Playback speed e.g. 2 for twice as fast, 0 to handle messages as fast as possible")
+
+args = parser.parse_args()
+
+from src.server.recorder import SessionReader
+
+mode = args.mode if args.mode is not None else SessionReader(args.recording).header.get("interpreter", "foxdot")
+
+from src.interpreter import get_interpreter
+
+lang = get_interpreter(mode)
+
+if lang is None:
+
+    sys.exit("FatalError: '{}' is not a valid interpreter.".format(mode))
+
+from src.server import ReplayServer
+
+myServer = ReplayServer(interpreter=lang)
+
+try:
+
+    count, elapsed = myServer.replay(args.recording, speed=args.speed)
+
+    print("Replayed {} messages in {:.2f}s ({:.0f} messages/s)".format(count, elapsed, count / elapsed if elapsed > 0 else 0))
+    print(myServer.get_stats())
+
+except KeyboardInterrupt:
+
+    pass
+
+finally:
+
+    myServer.kill()
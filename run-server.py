@@ -11,7 +11,11 @@ import argparse
 parser = argparse.ArgumentParser( prog="CodeBank Server Application" )
 
 parser.add_argument('-n', '--no-gui', action='store_false', help="Don't activate the GUI for the server")
-parser.add_argument('-m', '--mode', action='store', default="foxdot", help="Name of interpreter e.g. FoxDot")
+parser.add_argument('-m', '--mode', action='store', default="foxdot", help="Name of interpreter e.g. FoxDot, or Stub for testing without an audio engine")
+parser.add_argument('-e', '--engine', action='store', default="threaded", choices=["threaded", "asyncio"], help="Server engine for handling connections")
+parser.add_argument('-j', '--journal', action='store', default=None, help="File used to record the session and recover it after a restart")
+parser.add_argument('-d', '--history-depth', action='store', type=int, default=None, help="Number of older revisions kept for each codelet (default 100)")
+parser.add_argument('-r', '--record', action='store', default=None, help="File to record every message to so that the session can be replayed with 'run-replay.py'")
 
 args = parser.parse_args()
 
@@ -23,10 +27,14 @@ if lang is None:
 
     sys.exit("FatalError: '{}' is not a valid interpreter.".format(args.mode))
 
-from src.server import Server
+from src.server import Server, AsyncServer
 
-myServer = Server(interpreter=lang, visible=args.no_gui)
+ServerEngine = AsyncServer if args.engine == "asyncio" else Server
+
+myServer = ServerEngine(interpreter=lang, journal=args.journal, record=args.record, history_depth=args.history_depth, visible=args.no_gui)
 myServer.start()
 
+print(myServer.get_stats())
+
     
     
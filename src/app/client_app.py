@@ -5,6 +5,8 @@ from .connection_input import popup_window
 from .clock_nudge import ClockNudgePopup
 from ..utils import NULL, CONTROL_KEY, APP_TYPES
 
+from collections import deque
+
 # Class for interface for client-side
 
 class App(BasicApp):
@@ -50,7 +52,7 @@ class App(BasicApp):
             HANDLE_ERROR    : self.raise_error,
             HANDLE_INFO     : self.print_msg,
             HANDLE_REMOVE   : self.remove_user,
-            HANDLE_HISTORY  : self.load_codelet_history,
+            HANDLE_SNAPSHOT : self.load_snapshot,
             HANDLE_SHUTDOWN : self.shutdown_from_server,
             HANDLE_SEED     : self.update_random_seed,
             HANDLE_CHAT     : self.receive_chat_message,
@@ -58,6 +60,11 @@ class App(BasicApp):
             HANDLE_MONITOR_EVAL : self.evaluate_monitored_user,
         }
 
+        # Messages from the server are queued by the listening thread and handled
+        # in batches on the main thread once per frame
+
+        self.inbound = deque()
+
         # This stores the codelet being currently edited
 
         self.current_codelet  = NULL
@@ -491,41 +498,61 @@ class App(BasicApp):
 
         return
 
-    def load_codelet_history(self, user_id, codelet_id, data, order_id, is_hidden ):
-        """ Only called when connecting to a server: creates codelets and
-            runs the most recent item in the code. """
+    def load_snapshot(self, user_id, codelets):
+        """ Only called when connecting to a server: creates all the codelets and
+            runs the most recent item of each in a single batch. """
 
-        user_id, string = data[0] # editor of the code, user_id argument is likely -1
+        evaluated, code_strings = [], []
 
-        codelet = Codelet(codelet_id, user_id, string)
+        for codelet_id, data, order_id, is_hidden in codelets:
 
-        self.sharedspace.add_codelet(codelet)
+            editor_id, string, deltas = data
 
-        codelet.load_history(data)
+            codelet = Codelet(codelet_id, editor_id, string, order_id)
 
-        if is_hidden:
+            self.sharedspace.add_codelet(codelet)
 
-            # Hide the codelet if flagged
+            codelet.load_packed_history(data)
 
-            codelet.hide()
-            self.sharedspace.redraw()
+            if is_hidden:
 
-        else:
+                codelet.hide()
+
+                continue
 
-            # Evaluate the code as if done locally
-            
             code = codelet.get_text()
 
             if self.lang.contains_error(code):
 
                 codelet.flag_error()
 
-            else:
+            elif len(self.check_valid_command(code)) > 0:
+
+                # Let the local workspace report any banned commands
 
                 self.workspace.evaluate_code_locally(code)
 
-            self.sharedspace.redraw()
+            else:
+
+                self.send_monitored_code(code)
 
+                evaluated.append((codelet, code))
+                code_strings.append(code)
+
+        if len(code_strings) > 0:
+
+            self.evaluate_batch(code_strings, callback=lambda responses: self.snapshot_evaluated(evaluated, responses))
+
+        self.sharedspace.redraw()
+
+        return
+
+    def snapshot_evaluated(self, evaluated, responses):
+        """ Flags an error with each codelet from a snapshot whose response contains one """
+        for (codelet, string), response in zip(evaluated, responses):
+            if self.lang.contains_error(response) and codelet.get_text() == string:
+                codelet.flag_error()
+        self.sharedspace.redraw()
         return
 
     def disable_codelet(self, user_id, codelet_id):
@@ -538,8 +565,68 @@ class App(BasicApp):
         self.disable()
         return
 
-    def recv_codelet(self, user_id, code_id, string, order_id):
-        """ Handles a new/updated codelet """
+    def receive(self, data):
+        """ Adds a message from the server to the inbound queue. Can be called from any thread """
+        self.inbound.append(data)
+        self.sharedspace.frames.request("inbound", self.process_inbound)
+        return
+
+    def process_inbound(self):
+        """ Handles all of the queued messages from the server on the main thread """
+
+        batch = []
+
+        while len(self.inbound) > 0:
+
+            batch.append(self.inbound.popleft())
+
+        for data, latest in self.coalesce(batch):
+
+            try:
+
+                if latest:
+
+                    self.handle_data(data)
+
+                else:
+
+                    self.recv_codelet(*data[1:], evaluate=False)
+
+            except Exception as e:
+
+                print("Error handling {}: {}".format(data, e))
+
+        return
+
+    @staticmethod
+    def coalesce(batch):
+        """ Yields each message in a batch with a flag that is False for codelet updates
+            that are superseded by a later update in the batch (these are not evaluated).
+            Typing messages are dropped if there is a later one from the same user """
+
+        last_typing, last_update = {}, {}
+
+        for i, data in enumerate(batch):
+
+            if data[0] == HANDLE_TYPING:
+
+                last_typing[data[1]] = i
+
+            elif data[0] == HANDLE_UPDATE:
+
+                last_update[data[2]] = i
+
+        for i, data in enumerate(batch):
+
+            if data[0] == HANDLE_TYPING and last_typing[data[1]] != i:
+
+                continue
+
+            yield data, not (data[0] == HANDLE_UPDATE and last_update[data[2]] != i)
+
+    def recv_codelet(self, user_id, code_id, string, order_id, evaluate=True):
+        """ Handles a new/updated codelet. If `evaluate` is False, the codelet is updated
+            but not run e.g. if it is about to be updated again """
 
         # Find the code_id
 
@@ -565,7 +652,9 @@ class App(BasicApp):
 
         self.workspace.console.insert_user_update(self.socket.users[user_id], update_text)
 
-        self.evaluate_codelet(codelet)
+        if evaluate:
+
+            self.evaluate_codelet(codelet)
 
         return
 
@@ -674,6 +763,7 @@ class App(BasicApp):
 
     def set_user_id(self, user_id):
         self.socket.user_id = user_id
+        self.user_modified()
         return
 
     def raise_error(self, user_id, err_msg):
@@ -698,49 +788,29 @@ class App(BasicApp):
         if codelet_id == NULL:
             self.unhighlight_all_codelets()
         else:
-            self.get_codelet(codelet_id).highlight()
-            self.highlighted_codelet = codelet_id
+            self.sharedspace.codelets[codelet_id].highlight()
         return
 
     def highlight_codelet_up(self, event=None):
         """ Called when the user uses Alt+Up to cycle through the codelets """
         if self.current_codelet == NULL:
-            codeboxes = self.sharedspace.canvas.visible_codelets()
+            canvas = self.sharedspace.canvas
+            if len(canvas.get_visible_index()) == 0:
+                return "break"
             if self.highlighted_codelet == -1:
                 # Get bottom codebox
-                codebox = codeboxes[-1]
+                codebox = canvas.codebox_above()
             else:
                 # Find the codebox above the current one
-                codebox = codeboxes[0]
-                for n in range( len( codeboxes ) - 1 ):
-                    this_codebox = codeboxes[n + 1]
-                    if this_codebox.codelet.id == self.highlighted_codelet:
-                        this_codebox.codelet.de_highlight()
-                        break
-                    codebox = this_codebox
-                else:
-                    codebox = codeboxes[0]
+                codebox = canvas.codebox_above(self.sharedspace.codelets[self.highlighted_codelet])
             
             self.highlight_codelet(codebox.codelet.id)
             
             self.sharedspace.redraw()
 
-            # If codebox not in view, scroll up until it is
-
-            if not codebox.in_view():
-
-                self.sharedspace.canvas.yview_moveto(1)
-
-                while not codebox.in_view():
-
-                    self.sharedspace.canvas.yview_scroll(-1, "units")
-                    self.sharedspace.canvas.update()
-
-                    # If scrolled to top, break
-
-                    if self.sharedspace.y_scroll.get()[0] == 1.0:
+            # If codebox not in view, scroll to it
 
-                        break
+            canvas.see(codebox)
             
             self.set_mouse_in_codebox(False)
 
@@ -750,40 +820,23 @@ class App(BasicApp):
 
     def highlight_codelet_down(self, event=None):
         if self.current_codelet == NULL:
-            codeboxes = self.sharedspace.canvas.visible_codelets()
+            canvas = self.sharedspace.canvas
+            if len(canvas.get_visible_index()) == 0:
+                return "break"
             if self.highlighted_codelet == -1:
-                # Get bottom codebox
-                codebox = codeboxes[0]
+                # Get top codebox
+                codebox = canvas.codebox_below()
             else:
-                # Find the codebox above the current one
-                codebox = codeboxes[-1]
-                for n in range( len( codeboxes ), 0, -1 ):
-                    this_codebox = codeboxes[n - 1]
-                    if this_codebox.codelet.id == self.highlighted_codelet:
-                        this_codebox.codelet.de_highlight()
-                        break
-                    codebox = this_codebox
+                # Find the codebox below the current one
+                codebox = canvas.codebox_below(self.sharedspace.codelets[self.highlighted_codelet])
             
             self.highlight_codelet(codebox.codelet.id)
             
             self.sharedspace.redraw()
 
-            # If codebox not in view, scroll down until it is
-
-            if not codebox.in_view():
-
-                self.sharedspace.canvas.yview_moveto(0)
-
-                while not codebox.in_view():
-
-                    self.sharedspace.canvas.yview_scroll(1, "units")
-                    self.sharedspace.canvas.update()
-
-                    # If scrolled to bottom, break
-
-                    if self.sharedspace.y_scroll.get()[1] == 1.0:
+            # If codebox not in view, scroll to it
 
-                        break
+            canvas.see(codebox)
 
             self.set_mouse_in_codebox(False)
 
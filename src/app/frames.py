@@ -0,0 +1,159 @@
+from __future__ import absolute_import, print_function
+
+import os
+import threading
+
+from collections import OrderedDict, deque
+
+from .tkimport import Tk
+
+class FrameScheduler:
+    """ Runs work on the Tk main thread once per frame. Requests can be made from
+        any thread: any that share a key before the next frame are collapsed into a
+        single call, and the number of calls requested and performed is counted for
+        each key. Work that shouldn't wait for the next frame can be requested with
+        `request_now`, which wakes the Tk loop through a pipe where supported """
+    def __init__(self, widget, fps=30):
+        self.widget  = widget
+        self.lock    = threading.Lock()
+        self.pending = OrderedDict()
+        self.urgent  = OrderedDict()
+        self.calls   = deque()
+
+        self.requested = {}
+        self.performed = {}
+
+        self.set_fps(fps)
+
+        self.wakeup_pipe = None
+        self.woken = False
+
+        self.init_wakeup()
+
+        self.widget.after(self.interval, self.run_frame)
+
+    def init_wakeup(self):
+        """ Creates a pipe that the Tk loop watches so that other threads can wake it
+            without calling Tk. Not available on Windows, where urgent requests are run
+            in the next frame instead """
+        if not hasattr(self.widget.tk, "createfilehandler"):
+            return
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self.widget.tk.createfilehandler(read_fd, Tk.READABLE, self.on_wakeup)
+        self.wakeup_pipe = (read_fd, write_fd)
+        return
+
+    def __str__(self):
+        return ", ".join("{}: {}/{}".format(key, self.performed.get(key, 0), self.requested[key]) for key in self.requested)
+
+    def set_fps(self, fps):
+        """ Sets the maximum number of frames run per second """
+        self.interval = max(1, int(1000 / fps))
+        return
+
+    def request(self, key, func):
+        """ Calls `func` in the next frame, unless something has already been requested
+            with the same key, in which case only the most recent function is called """
+        with self.lock:
+            self.pending[key] = func
+            self.requested[key] = self.requested.get(key, 0) + 1
+        return
+
+    def request_now(self, key, func):
+        """ Like `request` but wakes the Tk loop to call `func` as soon as possible
+            instead of waiting for the next frame """
+        with self.lock:
+            self.urgent[key] = func
+            self.requested[key] = self.requested.get(key, 0) + 1
+            if self.woken or self.wakeup_pipe is None:
+                return
+            self.woken = True
+        try:
+            os.write(self.wakeup_pipe[1], b"\0")
+        except BlockingIOError:
+            pass # Pipe is full so the Tk loop is already due to wake up
+        return
+
+    def on_wakeup(self, fd, mask):
+        """ Called by the Tk loop when `request_now` writes to the wakeup pipe """
+        with self.lock:
+            self.woken = False
+        try:
+            os.read(fd, 4096)
+        except BlockingIOError:
+            pass
+        self.run_urgent()
+        return
+
+    def run_urgent(self):
+        """ Runs the work requested with `request_now` """
+        with self.lock:
+            urgent, self.urgent = self.urgent, OrderedDict()
+        for key, func in urgent.items():
+            self.performed[key] = self.performed.get(key, 0) + 1
+            self.run(func)
+        return
+
+    def close(self):
+        """ Stops watching and closes the wakeup pipe """
+        if self.wakeup_pipe is not None:
+            self.widget.tk.deletefilehandler(self.wakeup_pipe[0])
+            for fd in self.wakeup_pipe:
+                os.close(fd)
+            self.wakeup_pipe = None
+        return
+
+    def call(self, func, *args):
+        """ Calls `func(*args)` in the next frame. These are never collapsed and are
+            called in order before any requests """
+        self.calls.append((func, args))
+        return
+
+    def run_frame(self):
+        """ Runs the work due this frame and schedules the next one """
+
+        with self.lock:
+
+            pending, self.pending = self.pending, OrderedDict()
+
+        try:
+
+            self.run_urgent()
+
+            while len(self.calls) > 0:
+
+                func, args = self.calls.popleft()
+
+                self.run(func, *args)
+
+            for key, func in pending.items():
+
+                self.performed[key] = self.performed.get(key, 0) + 1
+
+                self.run(func)
+
+        finally:
+
+            self.widget.after(self.interval, self.run_frame)
+
+        return
+
+    def run(self, func, *args):
+        """ Calls `func(*args)` and prints any error so that it doesn't stop the
+            rest of the frame from running """
+        try:
+
+            func(*args)
+
+        except Exception as e:
+
+            print("Error in frame callback {}: {}".format(getattr(func, "__name__", func), e))
+
+        return
+
+    def get_stats(self):
+        """ Returns a dict of key to (requested, performed) counts """
+        with self.lock:
+            return dict((key, (self.requested[key], self.performed.get(key, 0))) for key in self.requested)
@@ -114,6 +114,7 @@ class BasicApp:
     
         if self.visible:
     
+            self.sharedspace.frames.close()
             self.root.destroy()
     
         return
@@ -145,22 +146,57 @@ class BasicApp:
         
         return
 
-    def evaluate(self, code, verbose=True):
-        """ Passes a string to FoxDot to exectute """
+    def schedule(self, func, *args):
+        """ Calls `func(*args)` on the main thread if using the GUI, otherwise straight away """
+        if self.visible:
+            self.sharedspace.frames.call(func, *args)
+        else:
+            func(*args)
+        return
+
+    def evaluate(self, code, verbose=True, callback=None):
+        """ Passes a string to the interpreter to be executed in the background. Returns a Future
+            for the response and, if given, calls `callback(response)` on the main thread """
         
         if self.lang is not None:
 
-            return self.lang.execute(code, verbose=verbose)
+            if callback is not None:
+
+                return self.lang.execute_async(code, verbose=verbose, callback=lambda response: self.schedule(callback, response))
+
+            return self.lang.execute_async(code, verbose=verbose)
 
         return 
 
+    def evaluate_batch(self, code_strings, verbose=True, callback=None):
+        """ Passes a list of strings to the interpreter to be executed as one block in the
+            background. If given, `callback(responses)` is called on the main thread """
+
+        if self.lang is not None:
+
+            if callback is not None:
+
+                return self.lang.execute_batch_async(code_strings, verbose=verbose, callback=lambda responses: self.schedule(callback, responses))
+
+            return self.lang.execute_batch_async(code_strings, verbose=verbose)
+
+        return
+
     def evaluate_codelet(self, codelet):
         """ Takes an instance of Codelet or CodeBox and evaluates the code. If there
             is an error, flag it with the codelet """
 
-        string = self.evaluate(codelet.get_text())
+        string = codelet.get_text()
+
+        self.evaluate(string, callback=lambda response: self.codelet_evaluated(codelet, string, response))
+
+        return
+
+    def codelet_evaluated(self, codelet, string, response):
+        """ Called once a codelet has been evaluated: flags an error if the response contains
+            one and the codelet has not been updated since """
 
-        if self.lang.contains_error(string):
+        if self.lang.contains_error(response) and codelet.get_text() == string:
 
             codelet.flag_error()
 
@@ -198,7 +234,16 @@ class BasicApp:
 
     def add_user(self, user_id, name):
         """ Stores a user's name and associates it with their ID - also updates UI based on this info """
-        self.socket.users[user_id] = User(user_id, name)
+        user = User(user_id, name)
+        user.set_observer(self.user_modified)
+        self.socket.users[user_id] = user
+        self.user_modified(user)
+        return
+
+    def user_modified(self, user=None):
+        """ Called when a user joins, leaves or changes state to update the peer list """
+        if self.visible:
+            self.sharedspace.peer_box.request_refresh()
         return
 
     def get_user_name(self, user_id):
@@ -207,6 +252,7 @@ class BasicApp:
     def remove_user(self, user_id):
         if user_id in self.socket.users:
             del self.socket.users[user_id]
+            self.user_modified()
         return
 
     def set_user_typing(self, user_id, flag):
@@ -218,6 +264,8 @@ class BasicApp:
         font = tkFont.nametofont("CodeFont")
         size = min(font.actual()["size"]+2, 28)
         font.configure(size=size)
+        self.sharedspace.canvas.layout_cache.clear()
+        self.sharedspace.peer_box.request_refresh()
         self.sharedspace.redraw()
         return "break"
 
@@ -225,6 +273,8 @@ class BasicApp:
         font = tkFont.nametofont("CodeFont")
         size = max(font.actual()["size"]-2, 8)
         font.configure(size=size)
+        self.sharedspace.canvas.layout_cache.clear()
+        self.sharedspace.peer_box.request_refresh()
         self.sharedspace.redraw()
         return "break"
 
@@ -3,9 +3,16 @@ from __future__ import absolute_import, print_function
 from ..tkimport import Tk
 from ...utils import CONTROL_KEY
 
+from collections import deque
+
 class Console(Tk.Text):
     """docstring for TextInput"""
+    max_lines = 1000 # lines of output kept in the console
     def __init__(self, *args, **kwargs):
+        # Writes can come from any thread so are buffered and inserted once per frame. Each
+        # entry is a tuple of (text, tag, colour) segments so that old entries are dropped whole
+        self.frames = kwargs.pop("frames", None)
+        self.pending = deque(maxlen=self.max_lines * 2)
         Tk.Text.__init__(self, *args, **kwargs)
         self.config(bg="black", height=10) # w = 50
         self.text_colour = "console"
@@ -15,19 +22,54 @@ class Console(Tk.Text):
 
     def write(self, string):
         """ Print to console """
-        self.enable()
-        self.insert(Tk.END, string + "\n", self.text_colour)
-        self.see(Tk.END)
-        self.disable()
+        self.pending.append(((string + "\n", self.text_colour, None),))
+        self.request_flush()
         return
 
     def insert_user_update(self, user, text):
-        self.enable()
-        self.tag_config(user.tag(), foreground=user.get_colour())
-        self.insert(Tk.END, user.get_name(), user.tag())
-        self.insert(Tk.END, " {}\n".format(text), self.text_colour)
-        self.see(Tk.END)
-        self.disable()
+        self.pending.append(((user.get_name(), user.tag(), user.get_colour()),
+                             (" {}\n".format(text), self.text_colour, None)))
+        self.request_flush()
+        return
+
+    def request_flush(self):
+        """ Schedules the buffered text to be added in the next frame """
+        if self.frames is not None:
+            self.frames.request("console", self.flush_pending)
+        else:
+            self.flush_pending()
+        return
+
+    def flush_pending(self):
+        """ Adds all buffered text in a single insert and trims the oldest lines """
+
+        chunks = []
+
+        while len(self.pending) > 0:
+
+            for text, tag, colour in self.pending.popleft():
+
+                if colour is not None:
+
+                    self.tag_config(tag, foreground=colour)
+
+                chunks.extend((text, tag))
+
+        if len(chunks) > 0:
+
+            self.enable()
+            self.insert(Tk.END, *chunks)
+            self.trim()
+            self.see(Tk.END)
+            self.disable()
+
+        return
+
+    def trim(self):
+        """ Deletes lines from the start of the console so that only max_lines are kept """
+        lines = int(self.index("end-1c").split(".")[0])
+        if lines > self.max_lines:
+            self.delete("1.0", "{}.0".format(lines - self.max_lines + 1))
         return
 
     def copy(self, *args):
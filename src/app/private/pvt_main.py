@@ -52,7 +52,7 @@ class Workspace(Tk.Frame):
         # Console
 
         self.c_container = Tk.Frame(self, bg="gray")
-        self.console = Console(self.c_container, font=self.font)
+        self.console = Console(self.c_container, frames=self.parent.sharedspace.frames, font=self.font)
 
         sys.stdout = self.console # routes stdout to print to console
 
@@ -3,8 +3,14 @@ from __future__ import absolute_import, print_function
 from ..tkimport import Tk
 from ...utils import CONTROL_KEY, NULL
 
+import itertools
+import time
+
+from collections import deque
+
 class TextInput(Tk.Text):
     """docstring for TextInput"""
+    colour_budget = 0.01 # seconds spent re-colouring lines per idle slice
     def __init__(self, parent, main, *args, **kwargs):
         Tk.Text.__init__(self, parent, *args, **kwargs)
         self.parent = main # pvt_main
@@ -29,6 +35,9 @@ class TextInput(Tk.Text):
         self.bind("<Delete>",    self.delete_key)
         self.bind("<Escape>",    lambda *e: self.root.reset_program_state())
 
+        self.bind("<<Paste>>",          self.paste)
+        self.bind("<<PasteSelection>>", self.paste)
+
         # Over-ride Key binding for undo/redo shortcuts : TODO - add to Menu
 
         self.bind("<{}-z>".format(CONTROL_KEY), lambda e: None)
@@ -41,6 +50,22 @@ class TextInput(Tk.Text):
         self.key_down = False
         self.is_typing = False
 
+        # Ranges of lines waiting to be re-coloured in the background, in the order they
+        # are coloured. Each range is a pair of marks so that they move with any edits.
+        # The generation is increased when all of the text is replaced so that stale
+        # work is dropped
+
+        self.dirty_ranges = deque()
+        self.dirty_marks = itertools.count()
+        self.colour_generation = 0
+        self.colour_job = None
+
+        # Lines in view, used to colour visible dirty lines first
+
+        self.visible_lines = None
+
+        self.config(yscrollcommand=self.view_changed)
+
     @staticmethod
     def convert_index(index1, index2=None):
         if type(index1) == str and index2 == None:
@@ -54,6 +79,8 @@ class TextInput(Tk.Text):
         for tag_name in self.colour_map:
             self.tag_config(tag_name, foreground=self.colour_map[tag_name][1])
         self.tag_config("highlight", background="red", foreground="white")
+        self.mark_dirty(1, self.get_last_line(), urgent=False)
+        self.view_changed()
         return
         
     def get_text(self):
@@ -65,7 +92,8 @@ class TextInput(Tk.Text):
         self.clear()
         self.insert("1.0", text)
         self.edit_reset()
-        self.update_colours()
+        self.mark_dirty(1, self.get_last_line(), urgent=False)
+        self.view_changed()
         return
 
     def select_all(self, event=None):
@@ -77,6 +105,7 @@ class TextInput(Tk.Text):
         self.delete(1.0, Tk.END)
         self.edit_reset()
         self.set_typing(False)
+        self.cancel_colouring()
         return
 
     def keypress(self, event):
@@ -88,6 +117,12 @@ class TextInput(Tk.Text):
             
             self.edit_separator()
 
+            # Lines may be joined so re-colour either side once the character is deleted
+
+            line = self.get_line_number(Tk.INSERT)
+
+            self.mark_dirty(line - 1, line + 1)
+
             # If we are deleting the last character, flag typing as False
 
             sel = self.delete_selection()
@@ -115,6 +150,11 @@ class TextInput(Tk.Text):
             self.delete_selection()
             self.insert(index, char)
             self.update_colours()
+
+            if char == "\n":
+
+                self.mark_dirty(self.get_line_number(index))
+
             self.edit_separator()
 
             self.set_typing(True)
@@ -198,6 +238,148 @@ class TextInput(Tk.Text):
         self.colour_line(line)
         return
 
+    def paste(self, event=None):
+        """ Re-colours pasted text in the background once it has been inserted """
+        start = self.get_line_number(Tk.INSERT)
+        self.after_idle(lambda: self.mark_dirty(start, self.get_line_number(Tk.INSERT)))
+        return
+
+    def get_line_number(self, index):
+        return int(self.index(index).split(".")[0])
+
+    def get_last_line(self):
+        return self.get_line_number("end-1c")
+
+    def mark_dirty(self, first, last=None, urgent=True):
+        """ Flags lines `first` to `last` (inclusive) to be re-coloured in the background.
+            Urgent ranges, e.g. around the cursor, are coloured before any others """
+        last = first if last is None else last
+        marks = self.new_dirty_range("{}.0".format(max(first, 1)), "{}.0 lineend".format(max(last, 1)))
+        if urgent:
+            self.dirty_ranges.appendleft(marks)
+        else:
+            self.dirty_ranges.append(marks)
+        if self.colour_job is None and self.lang is not None:
+            self.colour_job = self.after_idle(self.colour_dirty_lines, self.colour_generation)
+        return
+
+    def new_dirty_range(self, start, end):
+        """ Returns a pair of marks around the text to be re-coloured that stay around
+            the same text when lines are inserted or deleted before or inside it """
+        n = next(self.dirty_marks)
+        marks = ("dirty_start_{}".format(n), "dirty_end_{}".format(n))
+        self.mark_set(marks[0], start)
+        self.mark_gravity(marks[0], Tk.LEFT)
+        self.mark_set(marks[1], end)
+        self.mark_gravity(marks[1], Tk.RIGHT)
+        return marks
+
+    def get_dirty_lines(self, marks):
+        """ Returns the first and last line of a dirty range """
+        return self.get_line_number(marks[0]), self.get_line_number(marks[1])
+
+    def remove_dirty_range(self, marks):
+        self.mark_unset(*marks)
+        return
+
+    def cancel_colouring(self):
+        """ Drops any background re-colouring for text that has been replaced """
+        if self.colour_job is not None:
+            self.after_cancel(self.colour_job)
+            self.colour_job = None
+        self.colour_generation += 1
+        self.visible_lines = None
+        while len(self.dirty_ranges) > 0:
+            self.remove_dirty_range(self.dirty_ranges.popleft())
+        return
+
+    def view_changed(self, first=None, last=None):
+        """ Called by Tk when the view is scrolled or resized: moves the visible part
+            of any dirty ranges to the front of the queue """
+
+        visible = (self.get_line_number("@0,0"), self.get_line_number("@0,{}".format(self.winfo_height())))
+
+        if visible == self.visible_lines:
+
+            return
+
+        self.visible_lines = visible
+
+        first_visible, last_visible = visible
+
+        in_view, out_of_view = [], []
+
+        while len(self.dirty_ranges) > 0:
+
+            marks = self.dirty_ranges.popleft()
+
+            first_line, last_line = self.get_dirty_lines(marks)
+
+            if last_line < first_visible or first_line > last_visible:
+
+                out_of_view.append(marks)
+
+                continue
+
+            # Split off the parts of the range either side of the view
+
+            if first_line < first_visible:
+
+                out_of_view.append(self.new_dirty_range(marks[0], "{}.0 lineend".format(first_visible - 1)))
+
+                self.mark_set(marks[0], "{}.0".format(first_visible))
+
+            if last_line > last_visible:
+
+                out_of_view.append(self.new_dirty_range("{}.0".format(last_visible + 1), marks[1]))
+
+                self.mark_set(marks[1], "{}.0 lineend".format(last_visible))
+
+            in_view.append(marks)
+
+        self.dirty_ranges.extend(in_view)
+        self.dirty_ranges.extend(out_of_view)
+
+        return
+
+    def colour_dirty_lines(self, generation):
+        """ Re-colours dirty ranges in order until the time budget is used up and then
+            schedules itself to carry on once Tk is idle again """
+
+        self.colour_job = None
+
+        if generation != self.colour_generation:
+
+            return
+
+        deadline = time.time() + self.colour_budget
+
+        while len(self.dirty_ranges) > 0:
+
+            marks = self.dirty_ranges[0]
+
+            line, last_line = self.get_dirty_lines(marks)
+
+            self.colour_line(line)
+
+            if line >= last_line:
+
+                self.remove_dirty_range(self.dirty_ranges.popleft())
+
+            else:
+
+                self.mark_set(marks[0], "{}.0".format(line + 1))
+
+            if time.time() > deadline:
+
+                break
+
+        if len(self.dirty_ranges) > 0:
+
+            self.colour_job = self.after_idle(self.colour_dirty_lines, generation)
+
+        return
+
     def colour_line(self, line):
         """ Checks a line for any tags that match regex and updates IDE colours """
 
@@ -209,9 +391,9 @@ class TextInput(Tk.Text):
 
         try:
 
-            # Remove tags at current point
+            # Remove colour tags at current point
 
-            for tag_name in self.tag_names():
+            for tag_name in self.colour_map:
 
                 self.tag_remove(tag_name, start_of_line, end_of_line)
 
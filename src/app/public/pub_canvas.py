@@ -1,69 +1,302 @@
 from __future__ import absolute_import, print_function
 
 from ..tkimport import Tk
+from .pub_layout import TextLayoutCache
+
+import bisect, threading
+
+class CodeBoxIndex:
+    """ Keeps codeboxes in order from top to bottom (highest order id first). Codeboxes
+        are moved within the index when their order changes rather than re-sorted """
+    def __init__(self):
+        self.keys = []
+        self.codeboxes = []
+        self.positions = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.codeboxes)
+
+    def __contains__(self, codebox):
+        return codebox in self.positions
+
+    @staticmethod
+    def get_key(codebox):
+        return (-codebox.get_order_id(), codebox.get_id())
+
+    def add(self, codebox):
+        """ Inserts a codebox, or moves it if its order id has changed """
+        with self.lock:
+            key = self.get_key(codebox)
+            if self.positions.get(codebox) == key:
+                return
+            self.discard(codebox)
+            i = bisect.bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.codeboxes.insert(i, codebox)
+            self.positions[codebox] = key
+        return
+
+    def discard(self, codebox):
+        with self.lock:
+            if codebox in self.positions:
+                i = bisect.bisect_left(self.keys, self.positions.pop(codebox))
+                del self.keys[i]
+                del self.codeboxes[i]
+        return
+
+    def index(self, codebox):
+        """ Returns the position of a codebox in the index, or -1 if not in it """
+        with self.lock:
+            if codebox not in self.positions:
+                return -1
+            return bisect.bisect_left(self.keys, self.positions[codebox])
+
+    def get(self, i):
+        return self.codeboxes[i]
+
+    def items(self):
+        with self.lock:
+            return list(self.codeboxes)
 
 class SharedCanvas(Tk.Canvas):
+    margin = 200 # pixels above and below the visible area in which codeboxes are drawn
     def __init__(self, parent, *args, **kwargs):
         self.parent = parent
         Tk.Canvas.__init__(self, self.parent, **kwargs)
         self._switch_view_hidden = False
-        self.codeboxes = []
+
+        # All codeboxes and those that are not hidden, in order of top to bottom
+
+        self.index = CodeBoxIndex()
+        self.visible_index = CodeBoxIndex()
+
+        # The codebox that is currently highlighted
+
+        self.highlighted = None
         
         self.padx = 10
         self.pady = 10
 
         self._scrollable_region = None
 
-        self.bind("<Configure>", lambda e: self.parent.redraw())
+        # Codeboxes in the order they are laid out, with the y position of the bottom of each
+
+        self.layout = []
+        self.layout_bottoms = []
+
+        # Index in the layout of the first codebox whose height was corrected when drawn
+
+        self.relayout_from = None
+
+        # Codeboxes that currently have items on the canvas
+
+        self.drawn = set()
+
+        # Heights of wrapped codebox text
+
+        self.layout_cache = TextLayoutCache(self.parent.parent.font)
+        self._layout_width = None
+
+        self.bind("<Configure>", self.on_configure)
+
+    def on_configure(self, event=None):
+        """ Clears the stored text heights if the width has changed and redraws """
+        if self.get_width() != self._layout_width:
+            self._layout_width = self.get_width()
+            self.layout_cache.clear()
+        self.parent.redraw()
+        return
 
     def add(self, codebox):
-        self.codeboxes.append(codebox)
+        self.index.add(codebox)
+        self.reindex(codebox)
+        return
+
+    def reindex(self, codebox):
+        """ Updates the position of a codebox in the indices after its codelet has changed """
+        self.index.add(codebox)
+        if codebox.is_hidden():
+            self.visible_index.discard(codebox)
+        else:
+            self.visible_index.add(codebox)
         return
 
     def toggle_view_hidden(self):
         self._switch_view_hidden = not self._switch_view_hidden
 
+    def get_visible_index(self):
+        return self.index if self._switch_view_hidden else self.visible_index
+
     def ordered(self):
         """ Returns the codeboxes in order of top to bottom """
-        return sorted(self.codeboxes, key=lambda x: x.get_order_id(), reverse=True)
+        return self.index.items()
 
     def visible_codelets(self):
-        return [codebox for codebox in self.ordered() if codebox.is_visible()]
+        return self.get_visible_index().items()
+
+    def codebox_above(self, codebox=None):
+        """ Returns the visible codebox above `codebox`, or the bottom one if `codebox` is None """
+        index = self.get_visible_index()
+        if codebox is None:
+            return index.get(-1)
+        return index.get(max(index.index(codebox) - 1, 0))
+
+    def codebox_below(self, codebox=None):
+        """ Returns the visible codebox below `codebox`, or the top one if `codebox` is None """
+        index = self.get_visible_index()
+        if codebox is None:
+            return index.get(0)
+        i = index.index(codebox)
+        return index.get(0 if i < 0 else min(i + 1, len(index) - 1))
+
+    def see(self, codebox):
+        """ Scrolls the canvas so that `codebox` is in view """
+
+        if self._scrollable_region is None or codebox.in_view():
+
+            return
+
+        height = self._scrollable_region[3] - self._scrollable_region[1]
+
+        x1, y1, x2, y2 = self.get_visible_area()
+
+        x1, top, x2, bottom = codebox.bbox()
+
+        if top < y1:
+
+            target = top - self.pady
+
+        else:
+
+            target = bottom + self.pady - (y2 - y1)
+
+        self.yview_moveto(max(target, 0) / float(height))
+
+        return
+
+    def get_layout_key(self):
+        """ Returns the values that affect the size of every codebox. If these change,
+            all codeboxes need to be re-created """
+        font = self.parent.parent.font
+        return (self.get_width(), font.cget("family"), font.cget("size"))
+
+    def measure_text(self, text, width):
+        """ Returns the height of `text` when drawn in the code font wrapped to `width` """
+        return self.layout_cache.height(text, width)
 
     def redraw(self):
-        """ Redraws all the codebox labels in order of most recently edited """
+        """ Lays out all the codebox labels in order of most recently edited and draws
+            the ones in view. Only codeboxes that have changed are re-created """
+
+        layout = self.get_layout_key()
+
+        self.layout = []
+        self.layout_bottoms = []
 
         y = 0
         for codebox in self.ordered():
-            
-            # Clear screen
-            codebox.clear()
 
-            # Re-draw if not hidden or showing all hidden
-            if not codebox.is_hidden() or self._switch_view_hidden is True:
-            
-                # Re-draw
-                w, h = codebox.draw(self.padx, self.pady + y)
+            # Lay out if not hidden or showing all hidden
+            if codebox.is_visible():
+
+                h = codebox.measure(layout)
+                codebox.place(self.padx, self.pady + y)
                 y = y + h + self.pady
 
-        # Update the scrollable region when re-drawing
+                self.layout.append(codebox)
+                self.layout_bottoms.append(y)
 
-        bbox = self.bbox(Tk.ALL)
+            else:
 
-        if bbox is not None:
+                # Clear screen
+                codebox.clear()
+                self.drawn.discard(codebox)
 
-            # Add padding to scrollable region
+        # Update the scrollable region when re-drawing
 
-            x1, y1, x2, y2 = bbox
+        if len(self.layout) > 0:
 
-            self._scrollable_region = (x1, y1 - self.pady, x2, y2 + self.pady)
+            self._scrollable_region = (0, 0, self.winfo_width(), y + self.pady)
 
         else:
 
             self._scrollable_region = None
+
+        self.update_viewport()
                 
         return
 
+    def request_relayout(self, codebox):
+        """ Called when a codebox is drawn with a different height to the one it was laid
+            out with. Moves it, and the codeboxes below it, in the next frame """
+        i = bisect.bisect_right(self.layout_bottoms, codebox.get_top())
+        if self.relayout_from is None or i < self.relayout_from:
+            self.relayout_from = i
+        self.parent.frames.request("relayout", self.relayout)
+        return
+
+    def relayout(self):
+        """ Lays out the codeboxes from `relayout_from` downwards again without
+            measuring the ones above, then updates the view """
+
+        start, self.relayout_from = self.relayout_from, None
+
+        if start is None or start >= len(self.layout):
+
+            return
+
+        layout = self.get_layout_key()
+
+        y = self.layout_bottoms[start - 1] if start > 0 else 0
+
+        for i in range(start, len(self.layout)):
+
+            codebox = self.layout[i]
+
+            h = codebox.measure(layout)
+            codebox.place(self.padx, self.pady + y)
+            y = y + h + self.pady
+
+            self.layout_bottoms[i] = y
+
+        self._scrollable_region = (0, 0, self.winfo_width(), y + self.pady)
+
+        self.config(scrollregion=self._scrollable_region)
+
+        self.update_viewport()
+
+        return
+
+    def update_viewport(self):
+        """ Draws the codeboxes that are in (or near) the visible area and removes
+            the items of any that have gone out of view """
+
+        layout = self.get_layout_key()
+
+        x1, y1, x2, y2 = self.get_visible_area()
+
+        start = bisect.bisect_left(self.layout_bottoms, y1 - self.margin)
+        end   = start
+
+        while end < len(self.layout) and self.layout[end].get_top() <= y2 + self.margin:
+
+            end += 1
+
+        in_view = self.layout[start:end]
+
+        for codebox in self.drawn.difference(in_view):
+
+            codebox.clear()
+
+        for codebox in in_view:
+
+            codebox.draw(codebox.x, codebox.y, layout)
+
+        self.drawn = set(in_view)
+
+        return
+
     def get_width(self):
         return self.winfo_width() - self.padx
 
@@ -13,17 +13,39 @@ class CodeBox:
 
         self.id = None # Used by canvas
         self.bg = None
+
+        # Position and size from the last layout
+
+        self.x = 0
+        self.y = 0
+        self.height = 0
+        self.text_height = 0
+        self.measured = None
+
+        # State of the items currently on the canvas
+
+        self.drawn_version = None
+        self.drawn_layout  = None
+        self.drawn_pos     = None
+        self.drawn_size    = None
         
         self.codelet = codelet
 
         if self.root.visible:
 
             self.parent.canvas.add(self)
+            self.codelet.set_observer(self.codelet_modified)
+            self.bind_events()
             self.parent.redraw()
 
     def get_text(self):
         return self.codelet.get_text()
 
+    def codelet_modified(self, codelet):
+        """ Called whenever the codelet changes so that the canvas order can be updated """
+        self.parent.canvas.reindex(self)
+        return
+
     def get_colour(self):
         """ Returns the appropriate background colour based on the state of the codelet """
         if self.codelet.is_being_edited():
@@ -82,8 +104,57 @@ class CodeBox:
         self.parent.redraw()
         return
 
-    def draw(self, x_pos, y_pos):
-        """ Draws the codebox to fit, returns the dimensions """
+    def bind_events(self):
+        """ Adds callback bindings to the canvas tags, which also apply to any items
+            created with these tags later on """
+
+        for tag in (self.text_tag(), self.bg_tag()):
+
+            self.parent.canvas.tag_bind(tag, "<ButtonPress-1>", self.on_click)
+            self.parent.canvas.tag_bind(tag, "<Enter>", self.on_enter)
+            self.parent.canvas.tag_bind(tag, "<Leave>", self.on_leave)
+
+        return
+
+    def measure(self, layout=None):
+        """ Returns the height of the codebox, which is only re-measured if it has changed """
+        key = (self.codelet.get_version(), layout)
+        if self.measured != key:
+            self.text_height = self.parent.canvas.measure_text(self.get_text(), self.get_text_width())
+            self.height = self.text_height + (self.pady * 2) + self.bordersize
+            self.measured = key
+        return self.height
+
+    def get_text_width(self):
+        """ Returns the width that the codebox text wraps to """
+        return self.parent.canvas.get_width() - (self.padx * 2)
+
+    def place(self, x_pos, y_pos):
+        """ Sets the position of the codebox in the layout without drawing it """
+        self.x = x_pos
+        self.y = y_pos
+        return
+
+    def get_top(self):
+        return self.y
+
+    def is_dirty(self, layout=None):
+        """ Returns True if the codebox needs to be re-created to reflect its codelet """
+        return self.id is None or self.drawn_version != self.codelet.get_version() or self.drawn_layout != layout
+
+    def draw(self, x_pos, y_pos, layout=None):
+        """ Draws the codebox to fit, returns the dimensions. If nothing has changed
+            since it was last drawn, the existing items are just moved """
+
+        if not self.is_dirty(layout):
+
+            if self.drawn_pos != (x_pos, y_pos):
+
+                self.move(x_pos, y_pos)
+
+            return self.drawn_size
+
+        self.clear()
 
         canvas = self.parent.canvas # for easier reference
 
@@ -92,7 +163,7 @@ class CodeBox:
         self.id = int(canvas.create_text(x_pos + self.padx, y_pos + self.pady, 
             anchor=Tk.NW, 
             text=self.get_text(),
-            width=canvas.get_width() - (self.padx * 2), 
+            width=self.get_text_width(), 
             tags=self.text_tag(),
             font=self.root.font,
             fill=self.get_font_colour())
@@ -102,6 +173,15 @@ class CodeBox:
 
         bounds = canvas.bbox(self.id) 
 
+        # If the text was laid out with the wrong height, store the right one and move
+        # this codebox and the ones below it in the next frame
+
+        if bounds[3] - bounds[1] != self.text_height:
+
+            canvas.layout_cache.correct(self.get_text(), self.get_text_width(), bounds[3] - bounds[1])
+            self.measured = None
+            canvas.request_relayout(self)
+
         # Draw background
 
         self.bg = int(canvas.create_rectangle([bounds[0] - self.padx, bounds[1] - self.pady, canvas.get_width(), bounds[3] + self.pady], 
@@ -120,20 +200,28 @@ class CodeBox:
 
         canvas.tag_lower(self.bg, self.id)
 
-        # Add callback bindings
-
-        for item in (self.id, self.bg):
-
-            self.parent.canvas.tag_bind(item, "<ButtonPress-1>", self.on_click)
-            self.parent.canvas.tag_bind(item, "<Enter>", self.on_enter)
-            self.parent.canvas.tag_bind(item, "<Leave>", self.on_leave)
+        self.drawn_version = self.codelet.get_version()
+        self.drawn_layout  = layout
+        self.drawn_pos     = (x_pos, y_pos)
+        self.drawn_size    = (width, height)
         
         return width, height
 
+    def move(self, x_pos, y_pos):
+        """ Moves the existing canvas items so that the codebox is drawn at x_pos, y_pos """
+        dx = x_pos - self.drawn_pos[0]
+        dy = y_pos - self.drawn_pos[1]
+        for item in (self.id, self.bg):
+            self.parent.canvas.move(item, dx, dy)
+        self.drawn_pos = (x_pos, y_pos)
+        return
+
     def clear(self):
         if self.id is not None:
             self.parent.canvas.delete(self.id)
             self.parent.canvas.delete(self.bg)
+            self.id = None
+            self.bg = None
         return
         
     def on_click(self, event=None):
@@ -174,7 +262,8 @@ class CodeBox:
         return self.codelet
 
     def bbox(self):
-        return self.parent.canvas.bbox(self.bg)
+        """ Returns the area of the canvas that the codebox is laid out in, even if it is not drawn """
+        return (self.x, self.y, self.parent.canvas.get_width(), self.y + self.height)
 
     def in_view(self):
         """ Returns True if the code box is fully in view of the canvas """
@@ -201,6 +290,9 @@ class CodeBox:
     def is_being_edited(self):
         return self.codelet.is_being_edited()
 
+    def get_editor(self):
+        return self.codelet.get_editor()
+
     def get_id(self):
         return self.codelet.get_id()
 
@@ -213,6 +305,12 @@ class CodeBox:
     def load_history(self, data):
         return self.codelet.load_history(data)
 
+    def pack_history(self):
+        return self.codelet.pack_history()
+
+    def copy_history(self):
+        return self.codelet.copy_history()
+
     def flag_error(self):
         return self.codelet.flag_error()
 
@@ -232,16 +330,22 @@ class CodeBox:
         return self.codelet.un_hide()
 
     def highlight(self):
-        """ Calls de_highlight on all codelets then highlights this one """
-        for codelet in self.parent.canvas.ordered():
-            codelet.de_highlight()
+        """ Calls de_highlight on the previously highlighted codelet then highlights this one """
+        canvas = self.parent.canvas
+        if canvas.highlighted is not None and canvas.highlighted is not self:
+            canvas.highlighted.de_highlight()
         self.codelet.highlight()
+        canvas.highlighted = self
         self.root.highlighted_codelet = self.codelet.id
-        self.parent.canvas.itemconfig(self.bg, outline=self.get_outline_colour())
+        if self.bg is not None:
+            self.parent.canvas.itemconfig(self.bg, outline=self.get_outline_colour())
         return 
 
     def de_highlight(self):
         self.codelet.de_highlight()
+        if self.parent.canvas.highlighted is self:
+            self.parent.canvas.highlighted = None
         self.root.highlighted_codelet = NULL
-        self.parent.canvas.itemconfig(self.bg, outline=self.get_outline_colour())
+        if self.bg is not None:
+            self.parent.canvas.itemconfig(self.bg, outline=self.get_outline_colour())
         return 
@@ -0,0 +1,76 @@
+from __future__ import absolute_import, print_function
+
+import re
+
+from collections import OrderedDict
+
+class TextLayoutCache:
+    """ Stores the height of blocks of text when wrapped to a width in a font. Heights
+        are estimated with `font.measure` so no canvas items are needed, and can be
+        corrected once the text has actually been drawn """
+    re_words = re.compile(r"\S+\s*|\s+")
+    def __init__(self, font, size=2048):
+        self.font  = font
+        self.size  = size
+        self.cache = OrderedDict()
+
+    def get_key(self, text, width):
+        return (text, width, self.font.cget("family"), self.font.cget("size"))
+
+    def clear(self):
+        """ Forgets all stored heights e.g. when the font or width changes """
+        self.cache.clear()
+        return
+
+    def height(self, text, width):
+        """ Returns the height of `text` wrapped to `width` """
+        key = self.get_key(text, width)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            self.store(key, self.measure(text, width))
+        return self.cache[key]
+
+    def correct(self, text, width, height):
+        """ Replaces the estimated height of `text` with the height it was drawn at """
+        self.store(self.get_key(text, width), height)
+        return
+
+    def store(self, key, height):
+        self.cache[key] = height
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return
+
+    def measure(self, text, width):
+        """ Estimates the height of `text` from the number of lines it wraps to """
+        lines = sum(self.count_lines(line, width) for line in text.split("\n"))
+        return lines * self.font.metrics("linespace")
+
+    def count_lines(self, line, width):
+        """ Returns the number of lines a single line of text wraps to, breaking between
+            words where possible and within words that are wider than `width` """
+
+        if width <= 0 or self.font.measure(line) <= width:
+
+            return 1
+
+        lines, x = 1, 0
+
+        for word in self.re_words.findall(line):
+
+            text = word.rstrip()
+
+            w = self.font.measure(text)
+
+            if x > 0 and x + w > width:
+
+                lines, x = lines + 1, 0
+
+            while w > width:
+
+                lines, w = lines + 1, w - width
+
+            x += w + (self.font.measure(word[len(text):]) if len(text) < len(word) else 0)
+
+        return lines
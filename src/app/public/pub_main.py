@@ -1,13 +1,13 @@
 from __future__ import absolute_import, print_function
 
-import queue
-
 from ..tkimport import Tk
+from ..frames import FrameScheduler
 from .pub_canvas import SharedCanvas
 from .pub_code_box import CodeBox
 from .pub_peers import PeerBox
 
 class SharedSpace(Tk.Frame):
+    frame_rate = 30 # maximum number of redraws per second
     def __init__(self, parent):
         # Create a single frame to hold the representations of code chunks
         self.parent = parent
@@ -20,6 +20,9 @@ class SharedSpace(Tk.Frame):
 
             Tk.Frame.__init__(self, self.parent.root)
 
+            # Thread safe redraws, collapsed to one per frame
+            self.frames = FrameScheduler(self, fps=self.frame_rate)
+
             # Canvas and y-scroll
             self.canvas = SharedCanvas(self, width=640, height=480, bg="gray")
 
@@ -27,7 +30,7 @@ class SharedSpace(Tk.Frame):
             self.y_scroll.config(command=self.canvas.yview, orient=Tk.VERTICAL)
 
             self.canvas.config(
-                yscrollcommand=self.y_scroll.set,
+                yscrollcommand=self.scroll_set,
                 scrollregion=self.canvas.bbox(Tk.ALL)
                 )
 
@@ -66,9 +69,11 @@ class SharedSpace(Tk.Frame):
             self.padding.grid(row=0, column=3, sticky=Tk.NSEW)
             self.y_scroll.grid(row=0, column=4, sticky=Tk.NSEW)
 
-            # Thread safe redraw queue
-            self.queue = queue.Queue()
-            self.poll_queue()
+    def scroll_set(self, first, last):
+        """ Updates the scrollbar and draws any codeboxes that have scrolled into view """
+        self.y_scroll.set(first, last)
+        self.canvas.update_viewport()
+        return
 
     def add_codelet(self, codelet):
         """ Adds a new codelet to the canvas wrapped in a CodeBox instance """
@@ -78,7 +83,7 @@ class SharedSpace(Tk.Frame):
     def redraw(self):
         """ Schedules a redraw the canvas and update the scroll region that is thread-safe """
         if self.parent.visible:
-            self.queue.put(self._thread_safe_redraw)
+            self.frames.request("canvas", self._thread_safe_redraw)
         return
     
     def _thread_safe_redraw(self):
@@ -87,23 +92,6 @@ class SharedSpace(Tk.Frame):
         self.canvas.config(scrollregion=self.canvas.get_scrollable_region())
         return
 
-    def poll_queue(self):
-        """ Recursive call to poll the redraw queue and safely redraw the canvas """
-        try:
-
-            while True:
-                
-                func = self.queue.get_nowait()
-                func.__call__()
-
-        # Break the loop when the queue is empty        
-        except queue.Empty:
-            pass
-
-        # Call ~33 times a second
-        self.after(30, self.poll_queue)
-        return
-
     def drag_mouseclick(self, event=None):
         """ Flags the mouse as clicked for drag action """
         self.drag_mouse_down = True
@@ -50,43 +50,97 @@ class PeerBox(Tk.Frame):
         # Counter for dots drawing
 
         self.ticker = 0
-        self.frame  = 0
-        self.refresh_rate = 20 # times per second
+        self.animation = None
+        self.animation_interval = 500 # ms between steps of the typing animation
 
-        self.refresh(internal_call=True)
+        # State of each user's row when it was last drawn
 
-    def refresh(self, internal_call=False):
-        """ Clears the user list and redraws  """
-        
-        # Clear the contents
-        
-        self.listbox.delete("all")
+        self.rows = {}
+
+        self.listbox.bind("<Configure>", lambda e: self.request_refresh())
+
+        self.request_refresh()
+
+    def request_refresh(self):
+        """ Schedules a refresh in the next frame of the shared space """
+        self.parent.frames.request("peers", self.refresh)
+        return
+
+    def start_animation(self):
+        """ Starts the typing animation timer if it is not already running """
+        if self.animation is None:
+            self.animation = self.after(self.animation_interval, self.animate)
+        return
+
+    def animate(self):
+        """ Steps the typing animation. The timer stops once no one is typing """
+
+        self.animation = None
+
+        self.ticker = (self.ticker + 1) % 3
 
-        i = 0
+        if any(user.get_is_typing() for user in list(self.app.users.values())):
 
-        for user_id, user in list(self.app.users.items()):
+            self.request_refresh()
+
+            self.start_animation()
+
+        return
+
+    @staticmethod
+    def row_tag(user_id):
+        return "peer_{}".format(user_id)
+
+    def get_row_state(self, y_pos, user):
+        """ Returns the values used to draw a user's row """
+        local_user = self.app.get_user_id() if self.app.app_type == APP_TYPES.CLIENT else None
+        return (y_pos, user.get_name(), user.get_is_typing(), user.get_is_monitored(), local_user,
+                self.get_width(), self.font.cget("size"), self.ticker if user.get_is_typing() else None)
+
+    def refresh(self):
+        """ Redraws the rows of users that have joined, left or changed since the last refresh """
+
+        users = list(self.app.users.items())
+
+        # Remove users that have left
+
+        for user_id in list(self.rows.keys()):
+
+            if user_id not in self.app.users:
+
+                self.listbox.delete(self.row_tag(user_id))
+
+                del self.rows[user_id]
+
+        box_height = self.box_height
+
+        typing = False
+
+        for i, (user_id, user) in enumerate(users):
 
             y_pos = i * self.box_height
 
-            self.draw_user_box(y_pos, user)
+            state = self.get_row_state(y_pos, user)
+
+            if self.rows.get(user_id) != state:
 
-            i += 1
+                self.listbox.delete(self.row_tag(user_id))
 
-        # Recursive call if we don't call from external (stops extra recursive calls)
+                self.draw_user_box(y_pos, user)
 
-        if internal_call:
+                self.rows[user_id] = state
 
-            # Increase counter
+            typing = typing or user.get_is_typing()
 
-            self.frame += 1
+        # Rows need to be moved if their height has changed
 
-            if self.frame == self.refresh_rate // 2:
+        if self.box_height != box_height:
 
-                self.ticker = (self.ticker + 1) % 3
+            self.request_refresh()
 
-                self.frame  = 0
+        if typing:
 
-            self.after(1000 // self.refresh_rate, lambda: self.refresh(internal_call=True))
+            self.start_animation()
 
         return 
 
@@ -123,7 +177,8 @@ class PeerBox(Tk.Frame):
                     anchor=Tk.NW, 
                     text=user.get_name(),
                     width=self.get_width() - (self.padx * 2), 
-                    font=self.font
+                    font=self.font,
+                    tags=self.row_tag(user.id)
                     )
         
         # Get bbox of font
@@ -132,13 +187,13 @@ class PeerBox(Tk.Frame):
         # Draw background
         bbox = [0, bounds[1] - self.pady, self.get_width(), bounds[3] + self.pady]
 
-        rect = self.listbox.create_rectangle( bbox, fill=user.get_colour() )
+        rect = self.listbox.create_rectangle( bbox, fill=user.get_colour(), tags=self.row_tag(user.id) )
 
         if user.get_is_typing():
 
             # Draw dots
 
-            dots = self.draw_dots(y_pos)
+            dots = self.draw_dots(y_pos, self.row_tag(user.id))
 
             # Move other boxes above
 
@@ -163,7 +218,7 @@ class PeerBox(Tk.Frame):
         
         return 
 
-    def draw_dots(self, y_pos):
+    def draw_dots(self, y_pos, tags=None):
         """ Draws 3 circles and returns a list of their ID's """
         dots = []
         total_width = self.get_width()
@@ -180,7 +235,7 @@ class PeerBox(Tk.Frame):
             x = x_pos + (w * n * 1.5)
             y = int(y_pos + ((self.box_height * 2 / 3) - (h / 2)))
 
-            n = self.listbox.create_oval([x, y, x + w, y + h], fill=shade[n], outline=shade[n])
+            n = self.listbox.create_oval([x, y, x + w, y + h], fill=shade[n], outline=shade[n], tags=tags)
             
             dots.append(n)
         
@@ -197,13 +252,13 @@ class PeerBox(Tk.Frame):
 
         bbox1 = [self.padx, y_pos + offset1, self.padx + self.tick_box_size, y_pos + self.tick_box_size + offset1]
 
-        tick_box_outer = self.listbox.create_rectangle( bbox1 , fill="White" if user.id != local_user else "Gray") #
+        tick_box_outer = self.listbox.create_rectangle( bbox1 , fill="White" if user.id != local_user else "Gray", tags=self.row_tag(user.id)) #
 
         offset2 = max(self.tick_box_size // 6, 2) # Minimum 2 pixels
 
         bbox2 = [bbox1[0] + offset2, bbox1[1] + offset2, bbox1[2] - offset2, bbox1[3] - offset2]
 
-        tick_box_inner = self.listbox.create_rectangle( bbox2 , fill="Black" )
+        tick_box_inner = self.listbox.create_rectangle( bbox2 , fill="Black", tags=self.row_tag(user.id) )
 
         # Put monitoring box on top
 
@@ -23,7 +23,7 @@ class ServerApp(BasicApp):
             HANDLE_REQUEST : self.handle_request_codelet,
             HANDLE_RELEASE : self.handle_release_codelet,
             HANDLE_TYPING  : self.handle_set_user_typing,
-            HANDLE_REMOVE  : self.remove_user,
+            HANDLE_REMOVE  : self.handle_remove_user,
             HANDLE_CHAT    : self.receive_chat_message,
             HANDLE_CLEAR   : self.clear_clock,
             HANDLE_MONITOR_START : self.handle_start_user_monitoring,
@@ -31,21 +31,27 @@ class ServerApp(BasicApp):
             HANDLE_MONITOR_EVAL  : self.handle_forward_monitored_eval,
         }
 
-        # Poll the parent queue
+        # Process messages as soon as they are added to the server queue
+
+        self.dispatcher = None
 
         if self.visible:
 
             self.root.title("CodeBank Server: {}".format(self.socket.hostname))
 
-            self.poll_queue()
+            self.socket.queue.set_wakeup(self.wake)
 
     def run(self):
         if self.visible:
             BasicApp.run(self)
         else:
-            # Poll queue after server has started w/o runnng mainloop
+            # Dispatch messages on a worker thread after server has started w/o runnng mainloop
+            self.dispatcher = threading.Thread(target=self.dispatch_forever)
+            self.dispatcher.daemon = True
+            self.dispatcher.start()
             try:
-                self.poll_queue()
+                while self.dispatcher.is_alive():
+                    self.dispatcher.join(0.5)
             except KeyboardInterrupt:
                 self.kill()
         return
@@ -53,46 +59,73 @@ class ServerApp(BasicApp):
     def set_interpreter(self, *args, **kwargs):
         return BasicApp.set_interpreter(self, *args, verbose=False, **kwargs)
 
-    def poll_queue(self):
-        """ Continually poll the server process queue then process each message one at a time
+    def wake(self):
+        """ Called from the connection threads when a message is added to the server
+            queue - wakes the Tk thread to process it straight away. This doesn't call
+            Tk, so it is safe from any thread """
+        self.sharedspace.frames.request_now("queue", self.process_queue_data)
+        return
+
+    def dispatch_forever(self):
+        """ Blocks until a message is added to the server queue then handles it
             in the order it was added to the server. """
 
-        if self.visible:
+        while self.socket.running:
 
-            self.process_queue_data()
+            timestamp, data = self.socket.queue.get()
 
-            self.root.after(100, self.poll_queue)
+            if data is None:
 
-        else:
+                break
 
-            while self.socket.running:
+            self.handle_queue_data(timestamp, data)
 
-                self.process_queue_data()
-        
-                time.sleep(0.1)
-        
         return
 
-    def process_queue_data(self):
+    def process_queue_data(self, event=None):
+        """ Handles all the messages currently in the server queue """
 
         try:
 
             while True:
             
-                data = self.socket.queue.get_nowait()
-                    
-                self.handle_data(data)
+                timestamp, data = self.socket.queue.get_nowait()
+
+                if data is not None:
+
+                    self.handle_queue_data(timestamp, data)
 
         # Break the loop when the queue is empty
         except queue.Empty:
                 
             return
 
-    # Handler methods
+    def handle_queue_data(self, timestamp, data):
+        """ Handles a message from the server queue and records how long it took """
+        self.socket.record_message(timestamp, data)
+
+        try:
+
+            self.handle_data(data)
+
+        except Exception as e:
+
+            print("Error handling {}: {}".format(data, e))
+
+        self.socket.save_snapshot()
+
+        self.socket.queue.task_done(timestamp)
+
+        return
+
+    # Handler methods - lock, presence and chat messages are handled straight away, anything
+    # that needs the interpreter is run in order by the interpreter's worker thread
 
     def evaluate(self, *args, **kwargs):
-        BasicApp.evaluate(self, *args, **kwargs)
-        return print() # force newline
+        future = BasicApp.evaluate(self, *args, **kwargs)
+        if future is not None:
+            future.add_done_callback(lambda f: print()) # force newline
+        return future
 
     def handle_kill(self, user_id):
         return
@@ -149,7 +182,7 @@ class ServerApp(BasicApp):
 
         else:
 
-            codelet = Codelet(self.socket.next_codelet_id(), user_id, string, self.socket.next_order_id())
+            codelet = Codelet(self.socket.next_codelet_id(), user_id, string, self.socket.next_order_id(), self.socket.history_depth)
 
             self.sharedspace.add_codelet(codelet)
 
@@ -157,14 +190,16 @@ class ServerApp(BasicApp):
 
         self.users[user_id].clear_codelet()
 
-        # Evaluate the code
-
-        self.evaluate_codelet(codelet)
+        self.socket.record("update", user_id, codelet.get_id(), string, codelet.get_order_id())
 
         # Send back to clients
 
         self.socket.send_to_all(MESSAGE_UPDATE(user_id, codelet.get_id(), string, codelet.get_order_id()))
 
+        # Evaluate the code
+
+        self.evaluate_codelet(codelet)
+
         return
 
     def handle_release_codelet(self, user_id, codelet_id):
@@ -174,9 +209,21 @@ class ServerApp(BasicApp):
         self.socket.send_to_all(MESSAGE_RELEASE(user_id, codelet_id))
         return
 
+    def handle_remove_user(self, user_id):
+        """ Releases any codelet a user who has disconnected was editing and removes
+            them, unless they have already reconnected """
+        for codelet in self.get_codelets():
+            if codelet.get_editor() == user_id:
+                self.handle_release_codelet(user_id, codelet.get_id())
+        if not self.socket.is_connected(user_id):
+            self.remove_user(user_id)
+            self.socket.send_to_all(MESSAGE_REMOVE(user_id))
+        return
+
     def handle_hide_codelet(self, user_id, codelet_id):
         """ Labels the codelet as hidden and redraws the canvas, ignoring this codelet """
         self.get_codelet(codelet_id).hide()
+        self.socket.record("hide", codelet_id)
         self.sharedspace.redraw()
         self.socket.send_to_all(MESSAGE_HIDE(user_id, codelet_id))
         return
@@ -184,6 +231,7 @@ class ServerApp(BasicApp):
     def handle_rollback(self, user_id, codelet_id):
         """ Removes the last item in the history and redraws the shared-space """
         self.get_codelet(codelet_id).rollback()
+        self.socket.record("rollback", codelet_id)
         self.sharedspace.redraw()
         self.socket.send_to_all(MESSAGE_UNDO(user_id, codelet_id))
         return
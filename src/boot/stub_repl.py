@@ -0,0 +1,75 @@
+""" Minimal REPL used by the Stub interpreter for benchmarking without an audio engine.
+
+    Code is read from stdin in blocks ending with a blank line. Each block is "evaluated"
+    by waiting for the response delay and printing a number of lines of output, or an
+    error for a fraction of blocks. Lines starting with these commands are run straight
+    away and are not treated as code:
+
+    - echo <text> : prints the text, used for completion markers
+    - seed <n>    : resets the random number generator used for the delay and errors
+
+    The delay, amount of output and error rate can be set with the arguments below or
+    the CODEBANK_STUB_DELAY, CODEBANK_STUB_JITTER, CODEBANK_STUB_LINES,
+    CODEBANK_STUB_ERRORS and CODEBANK_STUB_SEED environment variables.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+def main():
+
+    parser = argparse.ArgumentParser(prog="stub_repl")
+    parser.add_argument("--delay", type=float, default=float(os.environ.get("CODEBANK_STUB_DELAY", 0)), help="Seconds taken to evaluate a block")
+    parser.add_argument("--jitter", type=float, default=float(os.environ.get("CODEBANK_STUB_JITTER", 0)), help="Maximum random seconds added to the delay")
+    parser.add_argument("--lines", type=int, default=int(os.environ.get("CODEBANK_STUB_LINES", 0)), help="Lines of output printed for each block")
+    parser.add_argument("--errors", type=float, default=float(os.environ.get("CODEBANK_STUB_ERRORS", 0)), help="Fraction of blocks that print an error")
+    parser.add_argument("--seed", type=int, default=int(os.environ.get("CODEBANK_STUB_SEED", 0)), help="Seed for the random number generator")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    count = 0
+    block = []
+
+    for line in sys.stdin:
+
+        line = line.rstrip("\n")
+
+        if line.startswith("echo "):
+
+            print(line[5:])
+
+        elif line.startswith("seed "):
+
+            rng.seed(int(line[5:]))
+
+        elif len(line.strip()) > 0:
+
+            block.append(line)
+
+        elif len(block) > 0:
+
+            count += 1
+
+            time.sleep(args.delay + rng.uniform(0, args.jitter))
+
+            if rng.random() < args.errors:
+
+                print("Error: simulated error in block {}".format(count))
+
+            for i in range(args.lines):
+
+                print("[{}] {}".format(count, block[i % len(block)]))
+
+            block = []
+
+        sys.stdout.flush()
+
+    return
+
+if __name__ == "__main__":
+
+    main()
@@ -15,6 +15,7 @@ class Client:
         self.port      = None
         self.address   = None
         self.socket    = None
+        self.reader    = None
         self.daemon    = None
         self.listening = False
         # User information
@@ -45,6 +46,10 @@ class Client:
 
             self.socket.connect(self.address)
 
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            self.reader = FrameReader(self.socket)
+
         except Exception as e:
 
             raise(e) # which one to use?
@@ -87,23 +92,26 @@ class Client:
         """ Sends data to server """
         return send_to_socket(self.socket, data)
 
-    def recv(self):
-        """ Read data from self.socket """
+    def recv(self, handler=None):
+        """ Read data from self.socket and pass it to `handler`, which is
+            the application's handle_data method by default """
         try:
-            data = read_from_socket(self.socket)
+            data = self.reader.read()
             if data is None:
                 return 0
         except ValueError as e:
             raise ConnectionError("Connection lost to server. {}".format(e))
-        self.app.handle_data(data)
+        if handler is None:
+            handler = self.app.handle_data
+        handler(data)
         return 1
 
     def listen(self):
-        """ Listens out for data coming from the server and passes it on
-            to the handler.
+        """ Listens out for data coming from the server and adds it to the
+            application's inbound queue to be handled on the main thread.
         """
         while self.listening:
-            if self.recv() is 0:
+            if self.recv(self.app.receive) == 0:
                 break
         return      
 
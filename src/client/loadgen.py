@@ -0,0 +1,386 @@
+from __future__ import absolute_import, print_function
+
+import random
+import re
+import socket
+import threading
+import time
+
+from collections import OrderedDict
+from hashlib import md5
+
+from ..utils import *
+from ..server.dispatch import LatencyStats
+
+class LoadStats:
+    """ Latency measurements and message counts shared by all simulated performers """
+    window = 100000
+    token_window = 10000 # Number of recent tokens remembered
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {
+            "fan-out"    : LatencyStats(self.window), # Message sent until received by another client
+            "lock-grant" : LatencyStats(self.window), # Codelet requested until the lock is granted
+        }
+        self.sent = 0
+        self.received = 0
+        self.lock_timeouts = 0
+        self.tokens = OrderedDict() # Token in a message: time sent
+
+    def add_latency(self, key, value):
+        with self.lock:
+            self.latency[key].add(value)
+        return
+
+    def message_sent(self, token=None):
+        with self.lock:
+            self.sent += 1
+            if token is not None:
+                self.tokens[token] = time.perf_counter()
+                if len(self.tokens) > self.token_window:
+                    self.tokens.popitem(last=False)
+        return
+
+    def message_received(self):
+        with self.lock:
+            self.received += 1
+        return
+
+    def get_sent_time(self, token):
+        with self.lock:
+            return self.tokens.get(token, None)
+
+class SimulatedPerformer:
+    """ Headless client that speaks the same protocol as `Client` and performs a random
+        mix of actions - pushing new code, editing and releasing existing codelets, chat
+        and typing - at an average of `rate` actions per second """
+    re_token = re.compile(r"lg\d+-\d+")
+    lock_timeout = 1.0
+    def __init__(self, generator, name):
+        self.generator = generator
+        self.stats     = generator.stats
+        self.name      = name
+        self.user_id   = None
+        self.socket    = None
+        self.reader    = None
+        self.running   = False
+        self.listener  = None
+        self.actor     = None
+        self.codelets  = set() # IDs of all codelets seen
+        self.requested = {}    # Codelet ID: time requested
+        self.granted   = threading.Event()
+        self.send_lock = threading.Lock() # Both the listener and actor threads send
+        self.count     = 0
+        self.random    = random.Random(name)
+
+    def connect(self, hostname, port, password, lang_id):
+        """ Logs in to the server and waits for a user ID """
+
+        self.socket = socket.create_connection((hostname, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.socket)
+
+        send_to_socket(self.socket, [self.name, md5(password.encode("utf-8")).hexdigest(), lang_id])
+
+        while self.user_id is None:
+
+            data = self.reader.read()
+
+            if data is None:
+
+                raise ConnectionError("Connection closed while logging in '{}'".format(self.name))
+
+            elif data[0] == HANDLE_ERROR:
+
+                raise ConnectionError(data[2])
+
+            self.handle_data(data)
+
+        return self
+
+    def start(self):
+        self.running  = True
+        self.listener = threading.Thread(target=self.listen)
+        self.listener.daemon = True
+        self.listener.start()
+        self.actor = threading.Thread(target=self.act)
+        self.actor.daemon = True
+        self.actor.start()
+        return
+
+    def stop(self):
+        self.running = False
+        return
+
+    def join(self):
+        """ Waits for the current action to finish after being stopped """
+        if self.actor is not None:
+            self.actor.join(self.lock_timeout + 1)
+        return
+
+    def kill(self):
+        """ Closes the connection """
+        self.running = False
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        return
+
+    def send(self, data, token=None):
+        self.stats.message_sent(token)
+        with self.send_lock:
+            return send_to_socket(self.socket, data)
+
+    def listen(self):
+        """ Handles messages from the server until the connection closes """
+        try:
+            while True:
+                data = self.reader.read()
+                if data is None:
+                    break
+                self.stats.message_received()
+                self.handle_data(data)
+        except (OSError, ValueError):
+            pass
+        return
+
+    def handle_data(self, data):
+        """ Keeps track of codelets and measures latencies """
+
+        header = data[0]
+
+        if header == HANDLE_SET_ID:
+
+            self.user_id = data[1]
+
+        elif header == HANDLE_SNAPSHOT:
+
+            self.codelets.update(codelet[0] for codelet in data[2])
+
+        elif header == HANDLE_UPDATE:
+
+            self.codelets.add(data[2])
+
+            if data[1] != self.user_id:
+
+                self.check_token(data[3])
+
+        elif header == HANDLE_CHAT:
+
+            if data[1] != self.user_id:
+
+                self.check_token(data[2])
+
+        elif header == HANDLE_LOAD:
+
+            if data[1] == self.user_id:
+
+                if data[2] in self.requested:
+
+                    self.stats.add_latency("lock-grant", time.perf_counter() - self.requested.pop(data[2]))
+
+                    self.granted.set()
+
+                else:
+
+                    # Granted after the request timed out so give the codelet back
+
+                    try:
+
+                        self.send(MESSAGE_RELEASE(self.user_id, data[2]))
+
+                    except OSError:
+
+                        pass
+
+        return
+
+    def check_token(self, string):
+        """ Records the fan-out latency of a message sent by another performer """
+        match = self.re_token.search(string)
+        if match is not None:
+            sent = self.stats.get_sent_time(match.group(0))
+            if sent is not None:
+                self.stats.add_latency("fan-out", time.perf_counter() - sent)
+        return
+
+    def next_token(self):
+        self.count += 1
+        return "lg{}-{}".format(self.user_id, self.count)
+
+    def get_code(self, token):
+        return self.generator.code_template.format(token=token, name=self.name, count=self.count)
+
+    def act(self):
+        """ Performs random actions until stopped """
+
+        actions = list(self.generator.mix.keys())
+        weights = [self.generator.mix[key] for key in actions]
+
+        while self.running:
+
+            time.sleep(self.random.expovariate(self.generator.rate))
+
+            if not self.running:
+
+                break
+
+            action = self.random.choices(actions, weights)[0]
+
+            if action in ("edit", "release") and len(self.codelets) == 0:
+
+                action = "push"
+
+            try:
+
+                getattr(self, "do_" + action)()
+
+            except OSError:
+
+                break
+
+        return
+
+    def do_push(self):
+        """ Pushes a new codelet """
+        token = self.next_token()
+        self.send(MESSAGE_PUSH(self.user_id, -1, self.get_code(token)), token)
+        return
+
+    def request_codelet(self):
+        """ Requests the lock on a random codelet and returns its ID if it is granted """
+
+        codelet_id = self.random.choice(list(self.codelets))
+
+        self.granted.clear()
+
+        self.requested[codelet_id] = time.perf_counter()
+
+        self.send(MESSAGE_REQUEST(self.user_id, codelet_id))
+
+        if self.granted.wait(self.lock_timeout):
+
+            return codelet_id
+
+        # Another performer has the codelet, unless it was granted just as we gave up
+
+        if self.requested.pop(codelet_id, None) is None:
+
+            return codelet_id
+
+        with self.stats.lock:
+
+            self.stats.lock_timeouts += 1
+
+        return None
+
+    def do_edit(self):
+        """ Requests a codelet and pushes new code to it """
+        codelet_id = self.request_codelet()
+        if codelet_id is not None:
+            token = self.next_token()
+            self.send(MESSAGE_PUSH(self.user_id, codelet_id, self.get_code(token)), token)
+        return
+
+    def do_release(self):
+        """ Requests a codelet and releases it without changes """
+        codelet_id = self.request_codelet()
+        if codelet_id is not None:
+            self.send(MESSAGE_RELEASE(self.user_id, codelet_id))
+        return
+
+    def do_chat(self):
+        token = self.next_token()
+        self.send(MESSAGE_CHAT(self.user_id, "{} says {}".format(self.name, token)), token)
+        return
+
+    def do_typing(self):
+        self.send(MESSAGE_TYPING(self.user_id, 1))
+        time.sleep(self.random.uniform(0, 0.5))
+        self.send(MESSAGE_TYPING(self.user_id, 0))
+        return
+
+class LoadGenerator:
+    """ Connects `clients` simulated performers to a server and runs them for
+        `duration` seconds, then reports throughput and latency percentiles. `mix`
+        gives the relative weight of each action a performer can take """
+    code_template = "# {token}\nprint('{name}', {count})"
+    default_mix = {"push": 1, "edit": 4, "release": 1, "chat": 1, "typing": 2}
+    def __init__(self, hostname, port, clients=10, rate=1.0, duration=10.0, password="", lang_id=0, mix=None):
+        self.hostname = hostname
+        self.port     = int(port)
+        self.clients  = clients
+        self.rate     = rate
+        self.duration = duration
+        self.password = password
+        self.lang_id  = lang_id
+        self.mix      = dict(self.default_mix if mix is None else mix)
+
+        for action in self.mix:
+
+            if not hasattr(SimulatedPerformer, "do_" + action):
+
+                raise ValueError("Unknown action '{}'".format(action))
+
+        self.stats      = LoadStats()
+        self.performers = []
+        self.elapsed    = 0.0
+
+    def run(self):
+        """ Connects the performers, runs them for the duration and disconnects """
+
+        try:
+
+            for n in range(self.clients):
+
+                performer = SimulatedPerformer(self, "loadgen{}".format(n))
+
+                self.performers.append(performer.connect(self.hostname, self.port, self.password, self.lang_id))
+
+            start = time.perf_counter()
+
+            for performer in self.performers:
+
+                performer.start()
+
+            time.sleep(self.duration)
+
+            for performer in self.performers:
+
+                performer.stop()
+
+            self.elapsed = time.perf_counter() - start
+
+            for performer in self.performers:
+
+                performer.join()
+
+        finally:
+
+            for performer in self.performers:
+
+                performer.kill()
+
+        return self
+
+    def report(self):
+        """ Returns a summary of the run as a string """
+
+        elapsed = self.elapsed if self.elapsed > 0 else 1
+
+        lines = [
+            "{} performers for {:.1f}s".format(len(self.performers), self.elapsed),
+            "Sent {} messages ({:.0f}/s), received {} ({:.0f}/s)".format(
+                self.stats.sent, self.stats.sent / elapsed, self.stats.received, self.stats.received / elapsed),
+            "Lock requests timed out: {}".format(self.stats.lock_timeouts),
+        ]
+
+        for key, stats in self.stats.latency.items():
+
+            lines.append("{:<10} n={} mean={:.2f}ms p50={:.2f}ms p95={:.2f}ms p99={:.2f}ms max={:.2f}ms".format(
+                key, stats.count, stats.mean() * 1000, stats.percentile(50) * 1000,
+                stats.percentile(95) * 1000, stats.percentile(99) * 1000, stats.max * 1000))
+
+        return "\n".join(lines)
@@ -1,16 +1,148 @@
 from .utils import GET_USER_COLOUR, NULL
 
+import base64, zlib
+
+from collections import deque
+
+class Revision:
+    """ An older revision of a codelet: the user that wrote it and its text compressed
+        using the revision after it as a dictionary (i.e. stored as a reverse delta) """
+    __slots__ = ("user_id", "data")
+    def __init__(self, user_id, data):
+        self.user_id = user_id
+        self.data    = data
+
+class CodeletHistory:
+    """ The revisions of a codelet as (user_id, string) pairs, oldest first. The most recent
+        revision is stored in full and only the last `depth` older revisions are kept. The
+        full list of revisions is only decompressed when needed and is kept until the
+        history next changes """
+    depth = 100
+    def __init__(self, data=(), depth=None):
+        self.head = None # (user_id, string)
+        self.revisions = deque(maxlen=self.depth if depth is None else depth)
+        self.cache = None # Decompressed revisions, oldest first
+        for user_id, string in data:
+            self.append(user_id, string)
+
+    def __len__(self):
+        return len(self.revisions) + (self.head is not None)
+
+    def __iter__(self):
+        return iter(self.get_revisions())
+
+    def __reversed__(self):
+        """ Yields the revisions newest first, decompressing each one only as it's reached """
+        if self.head is None:
+            return
+        yield self.head
+        string = self.head[1]
+        for revision in reversed(self.revisions):
+            string = self.decompress(revision.data, string)
+            yield (revision.user_id, string)
+        return
+
+    def __getitem__(self, i):
+        if i == -1 and self.head is not None:
+            return self.head
+        return self.get_revisions()[i]
+
+    def get_depth(self):
+        return self.revisions.maxlen
+
+    @staticmethod
+    def compress(string, newer):
+        """ Compresses `string` with the text of the revision after it as a dictionary """
+        obj = zlib.compressobj(zdict=newer.encode("utf-8"))
+        return obj.compress(string.encode("utf-8")) + obj.flush()
+
+    @staticmethod
+    def decompress(data, newer):
+        obj = zlib.decompressobj(zdict=newer.encode("utf-8"))
+        return (obj.decompress(data) + obj.flush()).decode("utf-8")
+
+    def append(self, user_id, string):
+        """ Adds a new revision and stores the previous one as a delta """
+        if self.head is not None:
+            self.revisions.append(Revision(self.head[0], self.compress(self.head[1], string)))
+        self.head = (user_id, string)
+        self.cache = None
+        return
+
+    def rollback(self, n=1):
+        """ Removes the last `n` revisions """
+        for _ in range(n):
+            if len(self.revisions) == 0:
+                self.head = None
+                break
+            revision = self.revisions.pop()
+            self.head = (revision.user_id, self.decompress(revision.data, self.head[1]))
+        if self.cache is not None:
+            self.cache = self.cache[:len(self)]
+        return
+
+    def get_text(self):
+        return self.head[1] if self.head is not None else ""
+
+    def get_user_id(self):
+        return self.head[0] if self.head is not None else None
+
+    def get_revisions(self):
+        """ Returns a tuple of all the revisions, oldest first, decompressing them only
+            if the history has changed since this was last called """
+        if self.cache is None:
+            revisions = list(reversed(self))
+            revisions.reverse()
+            self.cache = tuple(revisions)
+        return self.cache
+
+    def to_list(self):
+        """ Returns all the revisions as a list of (user_id, string) tuples, oldest first """
+        return list(self.get_revisions())
+
+    def copy(self):
+        """ Returns a copy that shares this history's revisions, which are never modified """
+        history = self.__class__(depth=self.revisions.maxlen)
+        history.head = self.head
+        history.revisions = self.revisions.copy()
+        history.cache = self.cache
+        return history
+
+    def pack(self):
+        """ Returns the history in a compact, JSON serialisable form: [user_id, string, deltas] """
+        if self.head is None:
+            return [None, "", []]
+        deltas = [[revision.user_id, base64.b64encode(revision.data).decode("ascii")] for revision in self.revisions]
+        return [self.head[0], self.head[1], deltas]
+
+    @classmethod
+    def unpack(cls, data, depth=None):
+        """ Creates a CodeletHistory from the output of `pack`. If `depth` isn't given
+            then all of the revisions are kept """
+        user_id, string, deltas = data
+        history = cls(depth=max(cls.depth, len(deltas)) if depth is None else depth)
+        for delta_user_id, delta in deltas:
+            history.revisions.append(Revision(delta_user_id, base64.b64decode(delta)))
+        if user_id is not None:
+            history.head = (user_id, string)
+        return history
+
 class Codelet:
-    def __init__(self, id_num, user_id, string, order_id=0):
+    def __init__(self, id_num, user_id, string, order_id=0, depth=None):
         # Unique identifier
         self.id = id_num
-        # A list of tuples; User & Code
-        self.history = []
+        # Revisions as tuples; User & Code. Only the last `depth` are kept
+        self.depth = depth
+        self.history = CodeletHistory(depth=depth)
         # Internal flags
         self.editor = None
         self.error  = False
         self.hidden = False
         self.highlighted = False
+        # Increased whenever the state used to draw the codelet changes
+        self.version = 0
+        # Called with the codelet whenever it is modified
+        self.observer = None
         
         self.update(user_id, string, order_id)
 
@@ -21,30 +153,58 @@ class Codelet:
             self.un_hide()
 
         if string != self.get_text():
-            self.history.append((user_id, string))
+            self.history.append(user_id, string)
             self.error = False
             self.order_id = order_id # might already be done if was hidden?
+            self.modified()
         return
 
     def rollback(self, n=1):
         assert type(n) == int
         if len(self.history) > 1:
-            self.history = self.history[:-n]
+            self.history.rollback(n)
+            self.modified()
         return
 
     def load_history(self, data):
-        self.history = data
+        self.history = CodeletHistory(data, self.depth)
+        self.modified()
+        return
+
+    def load_packed_history(self, data):
+        """ Loads history in the compact form returned by `pack_history` """
+        self.history = CodeletHistory.unpack(data, self.depth)
+        self.modified()
         return
 
+    def pack_history(self):
+        return self.history.pack()
+
+    def copy_history(self):
+        return self.history.copy()
+
+    def modified(self):
+        self.version += 1
+        if self.observer is not None:
+            self.observer(self)
+        return
+
+    def set_observer(self, func):
+        self.observer = func
+        return
+
+    def get_version(self):
+        return self.version
+
     def get_id(self):
         return self.id
 
     def get_text(self):
         """ Returns the *current* text of the codelet (empty string if no updates) """
-        return self.history[-1][1] if len(self.history) else ""
+        return self.history.get_text()
 
     def get_user_id(self):
-        return self.history[-1][0]
+        return self.history.get_user_id()
 
     def get_order_id(self):
         return self.order_id
@@ -60,9 +220,11 @@ class Codelet:
 
     def hide(self):
         self.hidden = True
+        self.modified()
 
     def un_hide(self):
         self.hidden = False
+        self.modified()
 
     def highlight(self):
         self.highlighted = True
@@ -75,18 +237,21 @@ class Codelet:
 
     def assign_editor(self, user_id):
         self.editor = user_id
+        self.modified()
         return
 
     def unassign_editor(self):
         self.editor = None
+        self.modified()
         return
 
     def get_history(self):
-        return self.history
+        return self.history.to_list()
 
     def flag_error(self):
         """ Turns the internal error (i.e. code contained error) flag to True """
         self.error = True
+        self.modified()
         return
 
     def has_error(self):
@@ -116,9 +281,21 @@ class User:
         self.is_monitored = False
         self.monitoring = []
 
+        # Called with the user whenever their state changes
+        self.observer = None
+
     def __repr__(self):
         return self.name
 
+    def modified(self):
+        if self.observer is not None:
+            self.observer(self)
+        return
+
+    def set_observer(self, func):
+        self.observer = func
+        return
+
     def get_name(self):
         return self.name
 
@@ -144,10 +321,12 @@ class User:
     def add_monitoring(self, user_id):
         if user_id not in self.monitoring:
             self.monitoring.append(user_id)
+            self.modified()
 
     def remove_monitoring(self, user_id):
         if user_id in self.monitoring:
             self.monitoring.remove(user_id)
+            self.modified()
 
     def monitor_evaluate(self, text):
         self.last_monitored_code = text
@@ -157,16 +336,22 @@ class User:
 
     def start_monitoring(self):
         self.is_monitored = True
+        self.modified()
 
     def stop_monitoring(self):
         self.is_monitored = False
         self.last_monitored_code = None
+        self.modified()
 
     def set_is_typing(self, flag):
-        self.is_typing = bool(flag)
+        if bool(flag) != self.is_typing:
+            self.is_typing = bool(flag)
+            self.modified()
 
     def assign_codelet(self, i):
         self.codelet_id = i
+        self.modified()
 
     def clear_codelet(self):
         self.codelet_id = NULL
+        self.modified()
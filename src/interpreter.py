@@ -1,20 +1,66 @@
-from .utils import SYSTEM, WINDOWS, TIDAL_BOOT_FILE, PYTHON_EXECUTABLE
-import re, shlex, threading, tempfile, time, sys
+from .utils import SYSTEM, WINDOWS, TIDAL_BOOT_FILE, STUB_REPL_FILE, PYTHON_EXECUTABLE
+import re, shlex, threading, time, sys, itertools
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, TimeoutExpired
 from subprocess import PIPE, STDOUT
 
 CREATE_NO_WINDOW = 0x08000000 if SYSTEM == WINDOWS else 0
 
+class OutputStream:
+    """ Bounded ring buffer of the lines written to stdout by an interpreter. Lines are
+        numbered as they arrive so that consumers can read or wait for anything after
+        a position returned by `position()` """
+    def __init__(self, maxlen=1000):
+        self.lines = deque(maxlen=maxlen)
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def append(self, line):
+        """ Adds a line to the buffer and wakes any waiting consumers """
+        with self.condition:
+            self.lines.append(line)
+            self.count += 1
+            self.condition.notify_all()
+        return
+
+    def close(self):
+        """ Flags that no more lines will be added """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        return
+
+    def position(self):
+        """ Returns the number of lines that have been added so far """
+        return self.count
+
+    def read_from(self, position):
+        """ Returns a list of the lines after `position` still in the buffer and the new position """
+        with self.condition:
+            start = max(position, self.count - len(self.lines))
+            lines = list(self.lines)[start - self.count:] if start < self.count else []
+            return lines, self.count
+
+    def wait(self, position, timeout=None):
+        """ Blocks until there is a line after `position`, the stream is closed, or the timeout is reached """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count > position or self.closed, timeout)
+
 class Interpreter:
     prompt = ">>>"
     name = "Interpreter"
     name_short = None
     name_long = None
     ident = None
+    marker_prefix = "__codebank_done_"
+    response_timeout = 5 # seconds to wait for a completion marker
+    style_cache_size = 1024 # number of lines whose styles are remembered
     def __init__(self, path, verbose=True):
 
         self.path = shlex.split(path)
-        self.stdout = tempfile.TemporaryFile("w+", 1) # buffering = 1
+        self.stdout = OutputStream()
         self.is_alive = True
         self.silent = not verbose
 
@@ -22,16 +68,22 @@ class Interpreter:
 
         self._last_response = None
         self._thread_lock = threading.Lock()
+        self._marker_count = itertools.count()
+
+        # Single worker so that asynchronous evaluations run in order
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
 
         try:
         
             self.process = Popen(self.path, shell=False, universal_newlines=True, bufsize=1,
                               stdin=PIPE,
-                              stdout=self.stdout,
-                              stderr=self.stdout,
+                              stdout=PIPE,
+                              stderr=STDOUT,
                               creationflags=CREATE_NO_WINDOW)
 
             self.stdout_thread = threading.Thread(target=self.read_stdout)
+            self.stdout_thread.daemon = True
             self.stdout_thread.start()
 
         except FileNotFoundError:
@@ -41,7 +93,9 @@ class Interpreter:
         self._banned_commands      = []
         self._unmonitored_commands = []
 
-        self._colour_map = {}
+        self._colour_map = OrderedDict()
+        self._tokenizer = None
+        self._style_cache = OrderedDict()
         
         self.execute_setup_code()
 
@@ -91,35 +145,130 @@ class Interpreter:
             
                 self.print_to_console(code_string)
             
+            position = self.stdout.position()
+            
             self.pipe_to_process(code_string)
+
+            # Ask the interpreter to print a marker once the code has been run
+
+            marker = self.pipe_marker()
             
-            output = self.wait_for_response()
+            output = self.wait_for_response(marker, position)
 
             self._thread_lock.release()
         
             return output
 
+    def execute_batch(self, code_strings, verbose=True):
+        """ Pipes several blocks of code into the interpreter in one go and returns a list
+            with the response to each block, using completion markers to tell them apart """
+
+        if self.get_marker_code(self.marker_prefix) is None:
+
+            # Without markers there is no way of splitting the output, so execute one at a time
+
+            return [self.execute(code_string, verbose) for code_string in code_strings]
+
+        with self._thread_lock:
+
+            position = self.stdout.position()
+
+            markers, blocks = [], []
+
+            for code_string in code_strings:
+
+                if verbose and not self.silent:
+
+                    self.print_to_console(code_string)
+
+                marker = self.next_marker()
+
+                blocks.append(self.format_code(code_string))
+                blocks.append(self.format_code(self.get_marker_code(marker)))
+
+                markers.append(marker)
+
+            self.write_to_process("".join(blocks))
+
+            return self.wait_for_responses(markers, position)
+
+    def execute_async(self, code_string, verbose=True, callback=None):
+        """ Queues a string to be piped into the interpreter by a worker thread and returns
+            a Future for the response. Code is executed in the order it is queued. If given,
+            `callback(response)` is called from the worker thread once done """
+        return self.submit(self.execute, code_string, verbose, callback=callback)
+
+    def execute_batch_async(self, code_strings, verbose=True, callback=None):
+        """ As `execute_async` but for `execute_batch`: the callback is given a list of responses """
+        return self.submit(self.execute_batch, code_strings, verbose, callback=callback)
+
+    def submit(self, func, *args, callback=None):
+        """ Runs `func(*args)` on the interpreter's worker thread and returns a Future """
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._execute_done(f, callback))
+        return future
+
+    def _execute_done(self, future, callback):
+        if future.cancelled():
+            return
+        elif future.exception() is not None:
+            print("Error evaluating code: {}".format(future.exception()))
+        elif callback is not None:
+            callback(future.result())
+        return
+
+    def get_marker_code(self, marker):
+        """ Returns code that prints `marker` on its own line. If None, a fixed wait is
+            used to collect the response instead """
+        return None
+
+    def pipe_marker(self):
+        """ Sends the code for printing a unique completion marker to the process and
+            returns the marker, or None if the interpreter does not support them """
+        marker = self.next_marker()
+        code = self.get_marker_code(marker)
+        if code is None:
+            return None
+        self.pipe_to_process(code)
+        return marker
+
+    def next_marker(self):
+        """ Returns a new unique completion marker """
+        return "{}{}__".format(self.marker_prefix, next(self._marker_count))
+
+    def is_marker(self, line):
+        """ Returns True if a line of output contains a completion marker """
+        return self.marker_prefix in line
+
     def pipe_to_process(self, string):
+        return self.write_to_process(self.format_code(string))
+
+    def write_to_process(self, string):
+        """ Writes an already formatted string to the stdin of the process """
         if self.is_alive:
-            self.process.stdin.write(self.format_code(string))
+            self.process.stdin.write(string)
             self.process.stdin.flush()
         return
 
     def read_stdout(self, text=""):
-        """ Continually reads the stdout from the self.process """
-        while self.is_alive:
-            if self.process.poll():
-                self.is_alive = False
-                break
-            try:
-                # Check contents of file
-                self._thread_lock.acquire()
-                self.get_response()
-                self._thread_lock.release()
-                time.sleep(0.05)
-            except ValueError as e:
-                print(e)
-                return
+        """ Continually reads lines from the stdout of self.process as they arrive, echoing
+            them to the console and adding them to the output stream """
+        for stdout_line in iter(self.process.stdout.readline, ""):
+            output = stdout_line.rstrip()
+            self.echo(stdout_line)
+            self.stdout.append(output)
+        self.is_alive = False
+        self.stdout.close()
+        return
+
+    def echo(self, stdout_line):
+        """ Prints a line of output to the console (completion markers are hidden) """
+        if self.is_marker(stdout_line):
+            return
+        if self.silent:
+            sys.stdout.write(stdout_line)
+        else:
+            sys.stdout.write(stdout_line.rstrip())
         return
 
     def print_to_console(self, string):
@@ -133,46 +282,82 @@ class Interpreter:
             sys.stdout.flush()
         return
 
-    def wait_for_response(self):
-        time.sleep(0.05)
-        return self.get_response()
+    def wait_for_response(self, marker=None, position=None):
+        """ Returns the output from the last block of code, i.e. after `position` in the output
+            stream. If `marker` is not None, this waits until the marker is printed (or the
+            timeout is reached) instead of a fixed time """
 
-    def get_response(self):
-        """ Waits a small amount of time to see if a process produces text output """        
-        self.stdout.seek(0)
+        if position is None:
 
-        lines = []
-        
-        for stdout_line in iter(self.stdout.readline, ""):
+            position = self.stdout.position()
 
-            output = stdout_line.rstrip()
+        if marker is None:
 
-            # If printing to console, write the original line
+            time.sleep(0.05)
 
-            if self.silent:
+            return self.get_response(position)
 
-                sys.stdout.write(stdout_line)
+        return self.wait_for_responses([marker], position)[0]
 
-            else:
+    def wait_for_responses(self, markers, position):
+        """ Reads the output stream from `position` and splits it into one response per
+            marker, in order. Gives up on any outstanding markers if no new one has been
+            printed within the timeout """
 
-                sys.stdout.write(output)
-            
-            lines.append(output)
-        
-        # clear tmpfile
-        self.stdout.truncate(0)
-        
-        return "\n".join(lines)
+        responses, lines = [], []
+
+        timeout = time.time() + self.response_timeout
+
+        while len(responses) < len(markers):
+
+            new_lines, position = self.stdout.read_from(position)
+
+            for line in new_lines:
+
+                if len(responses) < len(markers) and line.strip().endswith(markers[len(responses)]):
+
+                    responses.append("\n".join(lines))
+
+                    lines = []
+
+                    timeout = time.time() + self.response_timeout
+
+                elif not self.is_marker(line):
+
+                    lines.append(line)
+
+            remaining = timeout - time.time()
+
+            if len(responses) == len(markers) or remaining <= 0 or self.stdout.closed:
+
+                break
+
+            self.stdout.wait(position, remaining)
+
+        # Anything left over belongs to the first block without a marker
+
+        if len(responses) < len(markers):
+
+            responses.append("\n".join(lines))
+
+        return responses + [""] * (len(markers) - len(responses))
+
+    def get_response(self, position=0):
+        """ Returns the output in the stream after `position` as a single string """
+        lines, position = self.stdout.read_from(position)
+        return "\n".join(line for line in lines if not self.is_marker(line))
 
     def kill(self):
         """ Called to properly exit the subprocess and threads """
+        self._executor.shutdown(wait=False)
         self.is_alive = False
         if self.process.poll() is None:
             try:
-                self.process.communicate(timeout=3)
-            except TimeoutExpired:
+                self.process.stdin.close()
+                self.process.wait(timeout=3)
+            except (TimeoutExpired, OSError):
                 self.process.kill()
-                self.process.communicate()
+                self.process.wait()
         if self.stdout_thread is not None:
             self.stdout_thread.join(1)
         return
@@ -203,53 +388,47 @@ class Interpreter:
         return
 
     def add_to_colour_map(self, regex, colour, name=None):
+        """ Adds a RegEx for syntax highlighting. All of the RegExs are combined into a
+            single pattern so the whole match is coloured (use look-arounds for context),
+            matches do not overlap, and earlier entries take precedence """
         ident = str(name) if name is not None else "colour_map_{}".format(len(self._colour_map))
         self._colour_map[ident] = (regex, colour)
+        self._tokenizer = None
+        self._style_cache.clear()
         return
 
     def get_formatting(self):
-        """ Returns a dict of """
+        """ Returns a dict of tag names to (regex, colour) tuples """
         return self._colour_map
 
+    def get_tokenizer(self):
+        """ Returns the colour map compiled into one alternation of named groups """
+        if self._tokenizer is None:
+            self._tokenizer_tags = list(self._colour_map.keys())
+            self._tokenizer = re.compile("|".join("(?P<_{}>{})".format(i, self._colour_map[tag][0])
+                                                  for i, tag in enumerate(self._tokenizer_tags)))
+        return self._tokenizer
+
     def findstyles(self, line, *args):
         """ Finds any locations of any regex and returns the name
             of the style and the start and end point in the line """
 
-        tags = self._colour_map.keys()
-
-        pos = []
-
-        for tag in tags:
-
-            match_start = match_end = 0
-
-            for match in re.finditer(self._colour_map[tag][0], line):
-
-                looking = True
-
-                i = 0
+        if line in self._style_cache:
 
-                while looking:
+            self._style_cache.move_to_end(line)
 
-                    try:
+            return self._style_cache[line]
 
-                        start  = match.start(i)
-                        end    = match.end(i)
+        tokenizer = self.get_tokenizer()
 
-                        if start == end == -1:
+        pos = tuple((self._tokenizer_tags[int(match.lastgroup[1:])], match.start(), match.end())
+                    for match in tokenizer.finditer(line) if match.end() > match.start())
 
-                            raise IndexError # this is hacky af
+        self._style_cache[line] = pos
 
-                        match_start = start
-                        match_end   = end
+        if len(self._style_cache) > self.style_cache_size:
 
-                    except IndexError:
-
-                        looking = False
-
-                    i += 1
-
-                pos.append((tag, match_start, match_end))
+            self._style_cache.popitem(last=False)
 
         return pos
 
@@ -284,12 +463,12 @@ class FoxDot(Interpreter):
 
         # Set up syntax colouring
 
-        self.add_to_colour_map(r"(?<=def )(\w+)", '#29abe2', name="user_defn")
-        self.add_to_colour_map(r"(?<=>>)(\s*\w+)", '#ec4e20', name="players")
-        self.add_to_colour_map(r"^\s*#.*|[^\"']*(#[^\"']*$)", '#666666', name="comments")
-        self.add_to_colour_map(r"\W+(\d+)", '#e89c18', name="numbers")
-        self.add_to_colour_map(r"\".*?\"|\".*" + "|\'.*?\'|\'.*", "Green", name="strings")
-        self.add_to_colour_map(r"\s>>\s?", "#e89c18", name="arrow", )
+        self.add_to_colour_map(r"#.*", '#666666', name="comments")
+        self.add_to_colour_map(r"\"[^\"]*\"?|'[^']*'?", "Green", name="strings")
+        self.add_to_colour_map(r"(?<=def )\w+", '#29abe2', name="user_defn")
+        self.add_to_colour_map(r"(?<=>>)\s*\w+", '#ec4e20', name="players")
+        self.add_to_colour_map(r"(?<!\w)\d+", '#e89c18', name="numbers")
+        self.add_to_colour_map(r"\s?>>", "#e89c18", name="arrow", )
 
     def kill(self):
         self.execute("Clock.stop()")
@@ -298,6 +477,9 @@ class FoxDot(Interpreter):
     def format_code(self, string):
         return "{}\n\n".format(string)
 
+    def get_marker_code(self, marker):
+        return "print({!r})".format(marker)
+
     def start_server(self):
         return self.execute("allow_connections()", verbose=False)
 
@@ -370,11 +552,11 @@ class TidalCycles(Interpreter):
         self.add_banned_command(r".*hush.*")
 
         # Set up syntax colouring
-        self.add_to_colour_map(r"(?<=>>)(\s*\w+)", '#ec4e20', name="players")
-        self.add_to_colour_map(r"^\s*--.*|[^\"']*(--[^\"']*$)", '#666666', name="comments")
-        self.add_to_colour_map(r"\W+(\d+)", '#e89c18', name="numbers")
+        self.add_to_colour_map(r"--.*", '#666666', name="comments")
+        self.add_to_colour_map(r"\"[^\"]*\"?|'[^']*'?", "Green", name="strings")
+        self.add_to_colour_map(r"(?<=>>)\s*\w+", '#ec4e20', name="players")
+        self.add_to_colour_map(r"(?<!\w)\d+", '#e89c18', name="numbers")
         self.add_to_colour_map(r"\$|#", "Dark Green", name="syntax", )
-        self.add_to_colour_map(r"\".*?\"|\".*" + "|\'.*?\'|\'.*", "Green", name="strings")
 
     def execute_setup_code(self):
         # Import and setup tidal
@@ -392,6 +574,9 @@ class TidalCycles(Interpreter):
         """ Returns the code for stopping all sound / clearing a scheduling clock """
         return "hush"
 
+    def get_marker_code(self, marker):
+        return "putStrLn \"{}\"".format(marker)
+
     def get_nudge_code(self, value):
         return "nudge {}".format(value)
 
@@ -429,15 +614,54 @@ class TidalCyclesStack(TidalCycles):
     name_short = "tidalcyclesstack"
     name_long  = "TidalCycles (Stack)"
 
+class Stub(Interpreter):
+    """ Interpreter backed by a small local REPL (boot/stub_repl.py) instead of an audio
+        engine, for benchmarking and load-testing. Its response delay, lines of output and
+        error rate are set with the CODEBANK_STUB_* environment variables """
+    path = "{} -u {}".format(PYTHON_EXECUTABLE, shlex.quote(STUB_REPL_FILE))
+    re_streams = r"(\w+)\s*>>"
+    name_short = "stub"
+    name_long  = "Stub"
+    ident = 2
+    def __init__(self, *args, **kwargs):
+        Interpreter.__init__(self, self.__class__.path, *args, **kwargs)
+
+        self.add_to_colour_map(r"#.*", '#666666', name="comments")
+        self.add_to_colour_map(r"\"[^\"]*\"?|'[^']*'?", "Green", name="strings")
+        self.add_to_colour_map(r"(?<!\w)\d+", '#e89c18', name="numbers")
+
+    def format_code(self, string):
+        return "{}\n\n".format(string)
+
+    def get_marker_code(self, marker):
+        return "echo {}".format(marker)
+
+    def contains_error(self, response):
+        return response.lstrip().startswith("Error") if type(response) == str else False
+
+    def get_nudge_code(self, value):
+        return "nudge {}".format(value)
+
+    def get_random_seed_setter(self, seed):
+        return "seed {}".format(seed)
+
+    def get_stop_sound(self):
+        return "stop"
+
+    def get_reset_code(self, local_code, codelet_code):
+        return codelet_code if codelet_code != "" else self.get_stop_sound()
+
 
 
 LANGUAGE_IDENT = {  FoxDot.get_short_name() : FoxDot,
                     TidalCycles.get_short_name() : TidalCycles,
-                    TidalCyclesStack.get_short_name() : TidalCyclesStack }
+                    TidalCyclesStack.get_short_name() : TidalCyclesStack,
+                    Stub.get_short_name() : Stub }
 
 LANGUAGE_NAMES = { FoxDot.get_name() : FoxDot.get_short_name(),
                    TidalCycles.get_name() : TidalCycles.get_short_name(),
-                   TidalCyclesStack.get_name() : TidalCyclesStack.get_short_name() }
+                   TidalCyclesStack.get_name() : TidalCyclesStack.get_short_name(),
+                   Stub.get_name() : Stub.get_short_name() }
 
 def get_interpreter(name):
     return LANGUAGE_IDENT.get(name.lower(), None)
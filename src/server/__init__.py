@@ -1 +1,3 @@
 from .server import *
+from .async_server import *
+from .replay import *
@@ -0,0 +1,195 @@
+from __future__ import absolute_import, print_function
+
+import asyncio
+import time
+
+from threading import Thread
+
+from .server import *
+
+class AsyncServer(BaseServer):
+    """ Server engine that handles login, framing, dispatch and broadcast for every
+        connection on a single asyncio event loop instead of a thread per client. Without
+        a GUI, messages are passed straight to the ServerApp handlers on the event loop and
+        the interpreter runs code on its own executor. With a GUI, messages go through the
+        ServerApp process queue so that handlers run on the Tk thread """
+
+    def init_engine(self):
+        self.loop = asyncio.new_event_loop()
+        self.listener = self.loop.run_until_complete(
+            asyncio.start_server(self.handle_connection, self.listening_address, self.port)
+        )
+        self.server_thread = Thread(target=self.serve_forever)
+        return
+
+    def start_engine(self):
+        self.server_thread.start()
+        return
+
+    def stop_engine(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.server_thread.join(1)
+        return
+
+    def serve_forever(self):
+        """ Runs the event loop until the server is stopped """
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.listener.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+        return
+
+    def create_client(self, user_id, address, socket, name):
+        return AsyncClient(self.loop, user_id, address, socket, name,
+                           queue_size=self.client_queue_size,
+                           overflow_policy=self.client_overflow_policy)
+
+    async def read_message(self, reader):
+        """ Returns the next message from a connection or None if it was closed """
+        try:
+            header  = await reader.readexactly(FRAME_HEADER.size)
+            payload = await reader.readexactly(decode_frame_header(header))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return decode_frame(payload)
+
+    async def handle_connection(self, reader, writer):
+        """ Called for every new connection """
+        try:
+            await self.serve_connection(reader, writer)
+        except asyncio.CancelledError:
+            pass # Server is shutting down
+        finally:
+            writer.close()
+        return
+
+    async def serve_connection(self, reader, writer):
+        """ Logs the user in then continually reads messages and adds
+            them to the process queue until disconnected """
+
+        address = writer.get_extra_info("peername")[:2]
+
+        try:
+
+            data = await self.read_message(reader)
+
+            if data is None:
+
+                print("Client disconnected from {}".format(address))
+
+                raise ValueError
+
+            user_id, name = self.login(data, address, writer)
+
+        except ValueError:
+
+            # Just exit if the user disconnects during login
+
+            return
+
+        except LoginError as err:
+
+            writer.write(encode_message(MESSAGE_ERROR(-1, str(err))))
+
+            await writer.drain()
+
+            print("Failed login attempt from {} - {}".format(*address))
+
+            return
+
+        # Login succesful
+
+        print("New connection from {} - {}".format(*address))
+
+        self.handle_new_connection(user_id, name)
+
+        # Continually read from client until disconnected
+
+        while True:
+
+            try:
+
+                data = await self.read_message(reader)
+
+            except FrameError as err:
+
+                print("Invalid data from {} - {}".format(address, err))
+
+                data = None
+
+            if data is None:
+
+                print("Client disconnected from {}".format(address))
+
+                self.remove_from_server(address)
+
+                break
+
+            self.dispatch(data)
+
+        return
+
+    def dispatch(self, data):
+        """ Handles a message from a client on the event loop, or adds it to the process
+            queue to be handled by the Tk thread if the GUI is running """
+        if self.app.visible:
+            self.add_to_queue(data)
+        else:
+            self.app.handle_queue_data(time.perf_counter(), data)
+        return
+
+
+class AsyncClient(Client):
+    """ Connected client whose outbound queue is drained by a coroutine on the
+        server's event loop. `socket` is an asyncio.StreamWriter """
+    queue_full = asyncio.QueueFull
+    def __init__(self, loop, *args, **kwargs):
+        self.loop = loop
+        Client.__init__(self, *args, **kwargs)
+
+    def set_no_delay(self):
+        return # asyncio transports already disable Nagle's algorithm
+
+    def send_bytes(self, packet, ephemeral=False):
+        """ Schedules the message to be queued on the event loop (thread-safe) """
+        self.loop.call_soon_threadsafe(self.enqueue, packet, ephemeral)
+        return True
+
+    async def write_loop(self, writer, outbox):
+        """ Writes queued messages to the stream until the sentinel value (None) is received """
+        while True:
+            packet = await outbox.get()
+            if packet is None:
+                break
+            try:
+                writer.write(packet)
+                await writer.drain()
+            except ConnectionError:
+                break
+        return
+
+    def start_writer(self):
+        self.outbox = asyncio.Queue(self.queue_size)
+        self.writer = self.loop.create_task(self.write_loop(self.socket, self.outbox))
+        return
+
+    def stop_writer(self, timeout=None):
+        writer = self.writer
+        self.loop.call_soon_threadsafe(Client.stop_writer, self)
+        if writer is not None and timeout is not None:
+            future = asyncio.run_coroutine_threadsafe(asyncio.wait([writer], timeout=timeout), self.loop)
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+        return
+
+    def close_connection(self):
+        self.loop.call_soon_threadsafe(self.socket.close)
+        return
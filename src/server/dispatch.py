@@ -0,0 +1,75 @@
+from __future__ import absolute_import, print_function
+
+import queue
+import time
+
+from collections import deque
+
+class LatencyStats:
+    """ Keeps a running count, mean and maximum of latency measurements (in seconds)
+        along with a window of recent values for percentiles """
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.0
+        self.max   = 0.0
+        self.recent = deque(maxlen=window)
+
+    def __str__(self):
+        return "n={} mean={:.2f}ms p95={:.2f}ms max={:.2f}ms".format(
+            self.count, self.mean() * 1000, self.percentile(95) * 1000, self.max * 1000)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        return
+
+    def mean(self):
+        return (self.total / self.count) if self.count else 0.0
+
+    def percentile(self, p):
+        """ Returns the p-th percentile of the recent measurements """
+        values = sorted(self.recent)
+        if len(values) == 0:
+            return 0.0
+        i = min(len(values) - 1, int(round((p / 100.0) * (len(values) - 1))))
+        return values[i]
+
+class MessageQueue:
+    """ Process queue between the connection handlers and the ServerApp. The consumer
+        is woken as soon as a message is added and the time between a message being
+        added and handled is recorded in `latency` """
+    def __init__(self):
+        self.queue   = queue.Queue()
+        self.wakeup  = None
+        self.latency = LatencyStats()
+
+    def set_wakeup(self, callback):
+        """ Sets a function that is called (from the producer's thread) whenever a message is added """
+        self.wakeup = callback
+        return
+
+    def put(self, data):
+        """ Adds a message to the queue and wakes up the consumer """
+        self.queue.put((time.perf_counter(), data))
+        if self.wakeup is not None:
+            self.wakeup()
+        return
+
+    def get(self, block=True, timeout=None):
+        """ Returns a tuple of (time added, message). The message is None once the queue is closed """
+        return self.queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self, timestamp):
+        """ Records the latency of a message that was added at `timestamp` """
+        self.latency.add(time.perf_counter() - timestamp)
+        return
+
+    def close(self):
+        """ Wakes up any blocking consumer with an empty message """
+        self.queue.put((time.perf_counter(), None))
+        return
@@ -0,0 +1,204 @@
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import queue
+import threading
+
+class SessionJournal:
+    """ Append-only record of the changes made to the shared code so that a server can
+        recover its session after a crash or restart. Each event is written as a line of
+        JSON, `[seq, name, *args]`, by a background thread so that handling messages never
+        waits on the disk. Every `snapshot_interval` events the server is asked for its
+        full state, which is written atomically alongside the journal before the journal
+        is truncated. Any objects in the state with a `pack` method, e.g. CodeletHistory,
+        are packed by the writer thread. Events:
+
+        - ["update", user_id, codelet_id, string, order_id]
+        - ["hide", codelet_id]
+        - ["rollback", codelet_id]
+        - ["user", user_id, name, host]
+    """
+    def __init__(self, path, snapshot_interval=1000):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.snapshot_interval = snapshot_interval
+
+        self.seq   = 0
+        self.count = 0 # Events recorded since the last snapshot
+        self.lock  = threading.Lock()
+
+        self.queue  = queue.Queue()
+        self.torn   = False # True if the journal doesn't end with a complete line
+        self.file   = None
+        self.writer = None
+
+    def load(self):
+        """ Reads the most recent snapshot and the events recorded after it. Returns
+            a tuple of the snapshot state (an empty dict if there isn't one) and a list
+            of events """
+
+        state = {}
+
+        if os.path.exists(self.snapshot_path):
+
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+
+                state = json.load(f)
+
+        self.seq = state.get("seq", 0)
+
+        events = []
+
+        if os.path.exists(self.path):
+
+            with open(self.path, "r", encoding="utf-8") as f:
+
+                for line in f:
+
+                    self.torn = not line.endswith("\n")
+
+                    try:
+
+                        seq, event = self.decode(line)
+
+                    except ValueError:
+
+                        # The last line may be incomplete if the server crashed mid-write
+
+                        continue
+
+                    # Events already included in the snapshot
+
+                    if seq <= self.seq:
+
+                        continue
+
+                    events.append(event)
+
+                    self.seq = seq
+
+        self.count = len(events)
+
+        return state, events
+
+    @staticmethod
+    def encode(seq, event):
+        return json.dumps([seq] + list(event), separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def decode(line):
+        data = json.loads(line)
+        if not isinstance(data, list) or len(data) < 2:
+            raise ValueError("Invalid journal entry")
+        return data[0], data[1:]
+
+    def start(self):
+        """ Opens the journal for appending and starts the writer thread """
+        self.file = open(self.path, "a", encoding="utf-8")
+        if self.torn:
+            self.file.write("\n")
+            self.torn = False
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+        return
+
+    def close(self, timeout=None):
+        """ Writes any remaining events and stops the writer thread """
+        if self.writer is not None:
+            self.queue.put((None, None))
+            self.writer.join(timeout)
+            self.writer = None
+        return
+
+    def record(self, event):
+        """ Adds an event to the journal. Returns True if a snapshot is due """
+        with self.lock:
+            self.seq += 1
+            self.count += 1
+            self.queue.put((self.seq, event))
+            return self.count >= self.snapshot_interval
+
+    def snapshot(self, get_state):
+        """ Calls `get_state()` and queues the result to be written as a snapshot. This is
+            done while holding the lock so that no events can be recorded between the state
+            being taken and it being assigned a sequence number, so `get_state` should only
+            collect references and leave any expensive work to `pack` """
+        with self.lock:
+            state = get_state()
+            state["seq"] = self.seq
+            self.count = 0
+            self.queue.put((None, state))
+        return
+
+    def write_loop(self):
+        """ Writes events from the queue to disk, flushing once for every batch of
+            events that were waiting """
+
+        running = True
+
+        while running:
+
+            batch = [self.queue.get()]
+
+            while True:
+
+                try:
+
+                    batch.append(self.queue.get_nowait())
+
+                except queue.Empty:
+
+                    break
+
+            for seq, item in batch:
+
+                if seq is not None:
+
+                    self.file.write(self.encode(seq, item))
+
+                elif item is not None:
+
+                    self.write_snapshot(item)
+
+                else:
+
+                    running = False
+
+                    break
+
+            self.file.flush()
+
+        self.file.close()
+
+        return
+
+    @staticmethod
+    def pack(obj):
+        """ Converts objects in a snapshot that JSON can't store """
+        if hasattr(obj, "pack"):
+            return obj.pack()
+        raise TypeError("Object of type {} can't be stored in a snapshot".format(type(obj).__name__))
+
+    def write_snapshot(self, state):
+        """ Replaces the snapshot file with `state` and truncates the journal, which
+            only contains events already included in the snapshot """
+
+        tmp_path = self.snapshot_path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+
+            json.dump(state, f, separators=(",", ":"), default=self.pack)
+
+            f.flush()
+
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.snapshot_path)
+
+        self.file.close()
+
+        self.file = open(self.path, "w", encoding="utf-8")
+
+        return
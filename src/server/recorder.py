@@ -0,0 +1,100 @@
+from __future__ import absolute_import, print_function
+
+import gzip
+import json
+import queue
+import threading
+import time
+
+class SessionRecorder:
+    """ Records every message handled by a ServerApp, along with users joining, to a
+        gzipped file of JSON lines so that the session can be replayed later. The first
+        line is a header and each following line is one of:
+
+        - [time, "message", data]
+        - [time, "user", user_id, name]
+
+        where `time` is the number of seconds since recording started, taken from the
+        monotonic clock used by the server queue. Users leaving are recorded as the
+        MESSAGE_REMOVE the server handles when they disconnect, which also releases any
+        codelet they were editing. Lines are written by a background thread """
+    version = 1
+    def __init__(self, path, **header):
+        self.path   = path
+        self.header = dict(header, version=self.version)
+        self.start_time = time.perf_counter()
+
+        self.queue  = queue.Queue()
+        self.file   = None
+        self.writer = None
+
+    def start(self):
+        """ Opens the file, writes the header and starts the writer thread """
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.file.write(self.encode(self.header))
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+        return
+
+    def close(self, timeout=None):
+        """ Writes any remaining lines and closes the file """
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join(timeout)
+            self.writer = None
+        return
+
+    @staticmethod
+    def encode(item):
+        return json.dumps(item, separators=(",", ":")) + "\n"
+
+    def get_time(self, timestamp=None):
+        """ Returns the seconds between starting to record and `timestamp` (a value of
+            `time.perf_counter`), or now if not given """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        return round(timestamp - self.start_time, 6)
+
+    def record_message(self, timestamp, data):
+        """ Records a message that was added to the server queue at `timestamp` """
+        self.queue.put([self.get_time(timestamp), "message", data])
+        return
+
+    def record_user(self, user_id, name):
+        """ Records a new user joining the session """
+        self.queue.put([self.get_time(), "user", user_id, name])
+        return
+
+    def write_loop(self):
+        """ Writes lines from the queue until it's closed """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.file.write(self.encode(item))
+        self.file.close()
+        return
+
+class SessionReader:
+    """ Iterates over a recording made by SessionRecorder, reading one line at a
+        time so that long recordings don't have to fit in memory """
+    def __init__(self, path):
+        self.path = path
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            self.header = json.loads(f.readline())
+
+    def __iter__(self):
+        """ Yields tuples of (time, kind, args) """
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            f.readline() # header
+            try:
+                for line in f:
+                    item = json.loads(line)
+                    yield item[0], item[1], item[2:]
+            except (EOFError, ValueError):
+                pass # The recording was cut off e.g. the server crashed
+        return
+
+    def get_seed(self):
+        return self.header.get("seed", 0)
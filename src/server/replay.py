@@ -0,0 +1,83 @@
+from __future__ import absolute_import, print_function
+
+import time
+
+from hashlib import md5
+
+from .server import *
+from .recorder import SessionReader
+
+class ReplayServer(BaseServer):
+    """ Runs a session recorded with SessionRecorder through a headless ServerApp and
+        interpreter without any network connections. Messages are handled at the
+        times they were recorded, scaled by `speed`, or as fast as possible if `speed`
+        is 0 """
+
+    def __init__(self, interpreter, **kwargs):
+        kwargs["visible"] = False
+        BaseServer.__init__(self, interpreter, **kwargs)
+
+    def __str__(self):
+        return "replay"
+
+    def get_password(self):
+        return md5(b"")
+
+    def get_hostname(self):
+        return "localhost"
+
+    def init_engine(self):
+        return
+
+    def start_engine(self):
+        return
+
+    def stop_engine(self):
+        return
+
+    def replay(self, path, speed=1.0):
+        """ Handles each message in the recording at `path` then waits for the
+            interpreter to finish. Returns a tuple of the number of messages handled
+            and the time taken in seconds """
+
+        reader = SessionReader(path)
+
+        self.running = True
+        self.app.update_random_seed(seed=reader.get_seed())
+
+        count = 0
+        start = time.perf_counter()
+
+        for timestamp, kind, args in reader:
+
+            if speed > 0:
+
+                delay = start + (timestamp / speed) - time.perf_counter()
+
+                if delay > 0:
+
+                    time.sleep(delay)
+
+            if kind == "user":
+
+                self.add_user(*args)
+
+            elif kind == "message":
+
+                self.app.handle_queue_data(time.perf_counter(), args[0])
+
+                count += 1
+
+        # Wait for any code still to be evaluated
+
+        self.app.lang.submit(lambda: None).result()
+
+        return count, time.perf_counter() - start
+
+    def add_user(self, user_id, name):
+        """ Adds a user from the recording as a disconnected client """
+        if self.get_from_address_book(name, ("localhost", 0)) is None:
+            self.add_to_address_book(self.create_client(user_id, ("localhost", 0), None, name))
+            self.restore_counters(user_id, 0, 0)
+        self.app.add_user(user_id, name)
+        return
@@ -11,46 +11,59 @@ import sys
 import random
 import queue
 
-from threading import Thread
+from threading import Thread, Lock
 from time import sleep
 from getpass import getpass
 from hashlib import md5
 
 from ..utils import *
 from ..app import *
+from .dispatch import MessageQueue
+from .journal import SessionJournal
+from .recorder import SessionRecorder
 
-class ThreadedServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """ Base class """
-    pass
+# Policies for when a client's outbound queue is full
 
-class Server(ThreadedServer):
-    """ Wrapper to the threaded server instance """
-    def __init__(self, interpreter, **kwargs):
+OVERFLOW_DROP       = 0 # Drop ephemeral messages e.g. typing, disconnect if other messages overflow
+OVERFLOW_DISCONNECT = 1 # Disconnect the client as soon as any message overflows
 
-        # Get password
-        try:
+# Messages that can be safely dropped for a slow client
 
-            self.password = md5(getpass("Password (leave blank for no password): ").encode("utf-8"))
+EPHEMERAL_MESSAGES = (HANDLE_TYPING,)
 
-        except KeyboardInterrupt:
+class ThreadedServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ Base class """
+    daemon_threads = True # Don't wait for connected clients when closing
 
-            sys.exit("Exited")
+class BaseServer:
+    """ Login, client book-keeping and broadcast shared by the server engines. Sub-classes
+        implement `init_engine`, `start_engine` and `stop_engine` """
+    def __init__(self, interpreter, queue_size=1024, overflow_policy=OVERFLOW_DROP, journal=None, snapshot_interval=1000, record=None, history_depth=None, **kwargs):
+
+        # Get password
+        self.password = self.get_password()
 
         # Listen on any IP
         self.listening_address  = "0.0.0.0"
         self.port = SERVER_PORT_NUMER # from utils library
         
         # Get IP address
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        self.hostname = s.getsockname()[0]
-        s.close()
+        self.hostname = self.get_hostname()
 
         self.address = (self.hostname, self.port)
 
         # Create a process queue
 
-        self.queue = queue.Queue()
+        self.queue = MessageQueue()
+
+        # Size and overflow policy of each client's outbound queue
+
+        self.client_queue_size = queue_size
+        self.client_overflow_policy = overflow_policy
+
+        # Number of older revisions kept for each codelet (CodeletHistory.depth if None)
+
+        self.history_depth = history_depth
 
         # Keep track of all the connected clients
 
@@ -65,20 +78,58 @@ class Server(ThreadedServer):
 
         # Instantiate server process
 
-        ThreadedServer.__init__(self, (self.listening_address, self.port), RequestHandler)
-
-        self.server_thread = Thread(target=self.serve_forever)
         self.running = False
 
+        self.init_engine()
+
         # Create interface
 
         self.app = ServerApp(self, **kwargs)
         self.app.set_interpreter(interpreter)
         self.app.update_random_seed(seed=self.get_seed())
 
+        # Recover the codelets and users from a previous session
+
+        self.journal = None
+        self.snapshot_due = False
+        self.restored = []
+
+        if journal is not None:
+
+            self.journal = SessionJournal(journal, snapshot_interval)
+            self.restore_session(*self.journal.load())
+            self.journal.start()
+
+        # Record every message handled so that the session can be replayed
+
+        self.recorder = None
+
+        if record is not None:
+
+            self.recorder = SessionRecorder(record, seed=self.get_seed(), interpreter=self.app.lang.get_short_name())
+            self.recorder.start()
+
     def __str__(self):
         return "{} on port {}\n".format(self.hostname, self.port)
 
+    def get_password(self):
+        """ Asks for the password clients need to log in """
+        try:
+
+            return md5(getpass("Password (leave blank for no password): ").encode("utf-8"))
+
+        except KeyboardInterrupt:
+
+            sys.exit("Exited")
+
+    def get_hostname(self):
+        """ Returns the IP address of this machine on the network """
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        hostname = s.getsockname()[0]
+        s.close()
+        return hostname
+
     def start(self):
         """ Starts listening on the socket """
 
@@ -86,7 +137,8 @@ class Server(ThreadedServer):
 
         self.app.lang.start_server()        
         self.running = True
-        self.server_thread.start()
+        self.evaluate_restored()
+        self.start_engine()
         self.app.run()
 
         return
@@ -95,27 +147,57 @@ class Server(ThreadedServer):
         """ Adds a message to the process queue """
         return self.queue.put(message)
 
+    def dispatch(self, data):
+        """ Passes a message from a client to the ServerApp to be handled """
+        return self.add_to_queue(data)
+
     def kill(self):
         """ Properly terminates the server instance """
         
         # Stop running loop
 
         self.running = False
+        self.queue.close()
         self.app.lang.stop_server()
         self.app.lang.kill()
 
         self.send_to_all(MESSAGE_SHUTDOWN())
 
+        # Give each client a moment to receive the shutdown message
+        for client in list(self.clients):
+
+            client.stop_writer(timeout=1)
+
         # Remove users
         for user_id in list(self.users.keys()):
 
             self.app.remove_user(user_id)
 
         # Close server
-        self.shutdown()
-        self.server_close()
+        self.stop_engine()
+
+        if self.journal is not None:
+
+            self.journal.close(timeout=5)
+
+        if self.recorder is not None:
+
+            self.recorder.close(timeout=5)
+
         return
 
+    def init_engine(self):
+        """ Creates the listening socket """
+        raise NotImplementedError
+
+    def start_engine(self):
+        """ Starts accepting connections in the background """
+        raise NotImplementedError
+
+    def stop_engine(self):
+        """ Stops accepting connections and closes the listening socket """
+        raise NotImplementedError
+
     def next_client_id(self):
         self.__client_id += 1
         return self.__client_id
@@ -131,6 +213,120 @@ class Server(ThreadedServer):
     def get_seed(self):
         return self.__seed
 
+    def restore_counters(self, client_id, codelet_id, order_id):
+        """ Makes sure new IDs are greater than any restored from a previous session """
+        self.__client_id  = max(self.__client_id, client_id)
+        self.__codelet_id = max(self.__codelet_id, codelet_id)
+        self.__order_id   = max(self.__order_id, order_id)
+        return
+
+    def record(self, *event):
+        """ Adds an event to the session journal, if there is one. Events can be recorded
+            from any thread, so a snapshot that is due is taken by `save_snapshot` """
+        if self.journal is not None:
+            if self.journal.record(event):
+                self.snapshot_due = True
+        return
+
+    def save_snapshot(self):
+        """ Snapshots the session if one is due. Called by the ServerApp between messages
+            on the thread that modifies the codelets """
+        if self.snapshot_due:
+            self.snapshot_due = False
+            self.journal.snapshot(self.get_session_state)
+        return
+
+    def record_message(self, timestamp, data):
+        """ Adds a message handled by the ServerApp to the session recording, if there is one """
+        if self.recorder is not None:
+            self.recorder.record_message(timestamp, data)
+        return
+
+    def get_session_state(self):
+        """ Returns the codelets and users of this session. Histories are copied rather than
+            packed, which the journal does when it writes the snapshot """
+        codelets = [[codelet.get_id(), codelet.copy_history(), codelet.get_order_id(), int(codelet.is_hidden())] for codelet in list(self.app.get_codelets())]
+        users = [[client.get_id(), client.name, client.host] for client in list(self.address_book.values())]
+        return {"codelets": codelets, "users": users}
+
+    def restore_session(self, state, events):
+        """ Rebuilds the codelets and address book from a snapshot and the journal
+            events recorded after it. The current text of each codelet is evaluated
+            once the server has started """
+
+        codelets = self.app.sharedspace.codelets
+
+        for codelet_id, data, order_id, hidden in state.get("codelets", []):
+
+            codelet = Codelet(codelet_id, data[0], data[1], order_id, self.history_depth)
+            codelet.load_packed_history(data)
+
+            if hidden:
+
+                codelet.hide()
+
+            self.app.sharedspace.add_codelet(codelet)
+
+        for user_id, name, host in state.get("users", []):
+
+            self.restore_client(user_id, name, host)
+
+        for event in events:
+
+            name, args = event[0], event[1:]
+
+            if name == "update":
+
+                user_id, codelet_id, string, order_id = args
+
+                if codelet_id in codelets:
+
+                    codelets[codelet_id].update(user_id, string, order_id)
+
+                else:
+
+                    self.app.sharedspace.add_codelet(Codelet(codelet_id, user_id, string, order_id, self.history_depth))
+
+            elif name == "hide":
+
+                self.app.get_codelet(args[0]).hide()
+
+            elif name == "rollback":
+
+                self.app.get_codelet(args[0]).rollback()
+
+            elif name == "user":
+
+                self.restore_client(*args)
+
+        self.restore_counters(max([client.get_id() for client in self.address_book.values()] or [0]),
+                              max(list(codelets.keys()) or [0]),
+                              max([codelet.get_order_id() for codelet in codelets.values()] or [0]))
+
+        self.restored = [codelet for codelet in self.app.get_codelets() if not codelet.is_hidden()]
+
+        if len(codelets) > 0:
+
+            print("Restored {} codelet(s) and {} user(s) from '{}'".format(len(codelets), len(self.address_book), self.journal.path))
+
+            self.app.sharedspace.redraw()
+
+        return
+
+    def restore_client(self, user_id, name, host):
+        """ Adds a disconnected client from a previous session to the address book so
+            that the user keeps their ID when they reconnect """
+        self.add_to_address_book(self.create_client(user_id, (host, 0), None, name))
+        return
+
+    def evaluate_restored(self):
+        """ Runs the current text of each codelet restored from a previous session
+            in a single batch """
+        if len(self.restored) > 0:
+            self.app.evaluate_batch([codelet.get_text() for codelet in self.restored])
+            self.restored = []
+        return
+
     def get_from_address_book(self, name, address):
         """ """
         return self.address_book.get((name, address[0]), None)
@@ -155,15 +351,85 @@ class Server(ThreadedServer):
         else:
 
             user_id = self.next_client_id()
-            new_client = Client(user_id, address, socket, name)
+            new_client = self.create_client(user_id, address, socket, name)
 
             self.add_to_address_book( new_client )
 
+            self.record("user", user_id, name, address[0])
+
         self.clients.append( new_client )
         self.app.add_user(user_id, name)
+
+        if self.recorder is not None:
+
+            self.recorder.record_user(user_id, name)
         
         return user_id
 
+    def create_client(self, user_id, address, socket, name):
+        """ Returns a new Client instance for a connection """
+        return Client(user_id, address, socket, name,
+                      queue_size=self.client_queue_size,
+                      overflow_policy=self.client_overflow_policy)
+
+    def login(self, data, address, socket):
+        """ Checks the login details sent by a new connection and adds the client
+            to the server. Returns the user ID and name or raises a LoginError """
+
+        username = data[0]
+        password = data[1]
+        lang_id  = data[2]
+
+        if not self.authenticate(password):
+
+            raise LoginError("Failed Login - Incorrect password.")
+
+        elif not self.check_lang_id(lang_id):
+
+            raise LoginError("Failed Login - Incorrect interpreter. Please use '{}' to connect to the server.".format(self.app.lang.get_name()))
+
+        user_id = self.add_new_client(address, socket, username)
+
+        return user_id, username
+
+    def handle_new_connection(self, user_id, name):
+        """ Called during a connection, updates connected clients with name information
+            and resets the seed for random number generation etc.  """
+
+        # Send the user_id to the client
+
+        self.send_to_client(user_id, [HANDLE_SET_ID, user_id])
+
+        # Notify other users
+
+        self.send_to_all( MESSAGE_NAME(user_id, name) )
+
+        # Rest the seed
+
+        self.send_to_client(user_id, MESSAGE_SEED(seed=self.get_seed()) )
+
+        # Grab current code
+
+        self.pull_all_code(user_id)
+
+        return
+
+    def pull_all_code(self, user_id):
+        """ Sends all current codelet data to the client """
+        # Get all the connected users
+        for id_num, user in list(self.users.items()):
+            if id_num != user_id:
+                self.send_to_client(user_id, MESSAGE_NAME(id_num, user.get_name()))
+
+        # Get all the code in a single message
+        codelets = []
+        for codelet in self.app.get_codelets():
+            codelets.append([codelet.get_id(), codelet.pack_history(), codelet.get_order_id(), int(codelet.is_hidden())])
+        if len(codelets) > 0:
+            self.send_to_client(user_id, MESSAGE_SNAPSHOT(-1, codelets))
+
+        return
+
     def add_to_address_book(self, client):
         """ Stores a client in the address book dictionary """
         self.address_book[(client.name, client.host)] = client
@@ -176,22 +442,20 @@ class Server(ThreadedServer):
 
                 client.disconnect()
                 
-                self.app.remove_user(client.id)
-                
                 del self.clients[i]
 
-                # If the user has loaded a codelet, release it
-                codelet_id = self.users.get(client.id, None)
-                
-                if codelet_id is not None:
-                
-                    self.app.handle_release_codelet(client.id, codelet_id)
+                # Remove the user, and release any codelet they have loaded, after any
+                # messages they sent before disconnecting so that it is also recorded
                 
-                self.send_to_all(MESSAGE_REMOVE(client.id))
+                self.dispatch(MESSAGE_REMOVE(client.id))
                 
                 break
         return
 
+    def is_connected(self, user_id):
+        """ Returns True if a client with this ID is currently connected """
+        return any(client.id == user_id and client.connected for client in list(self.clients))
+
     def send_to_client(self, client_id, data):
         for client in list(self.clients):
             if client.id == client_id:
@@ -200,10 +464,27 @@ class Server(ThreadedServer):
         return
 
     def send_to_all(self, data):
+        """ Encodes the message once and sends the same buffer to every client """
+        packet = encode_message(data)
+        ephemeral = data[0] in EPHEMERAL_MESSAGES
         for client in list(self.clients):
-            client.send(data)
+            client.send_bytes(packet, ephemeral)
         return
 
+    def get_queue_depths(self):
+        """ Returns a dictionary of client ID to the number of messages waiting to be sent """
+        return dict((client.id, client.get_queue_depth()) for client in list(self.clients))
+
+    def get_stats(self):
+        """ Returns the message handling latency and, for each client, the number of
+            messages waiting to be sent and the number dropped, as a string """
+        lines = ["Handler latency: {}".format(self.queue.latency)]
+        for client in sorted(list(self.address_book.values()), key=lambda client: client.id):
+            lines.append("Client {} '{}': queued={} dropped={}{}".format(
+                client.id, client.name, client.get_queue_depth(), client.get_dropped(),
+                "" if client.connected else " (disconnected)"))
+        return "\n".join(lines)
+
     def connections(self):
         for client in list(self.clients):
             yield client.socket
@@ -217,6 +498,24 @@ class Server(ThreadedServer):
         return int(lang_id) == self.app.lang.get_id()
 
 
+class Server(BaseServer, ThreadedServer):
+    """ Threaded server engine: each connection is handled by a RequestHandler thread """
+
+    def init_engine(self):
+        ThreadedServer.__init__(self, (self.listening_address, self.port), RequestHandler)
+        self.server_thread = Thread(target=self.serve_forever)
+        return
+
+    def start_engine(self):
+        self.server_thread.start()
+        return
+
+    def stop_engine(self):
+        self.shutdown()
+        self.server_close()
+        return
+
+
 class RequestHandler(socketserver.BaseRequestHandler):
     """ Created whenever a new connection to the server is made:
         self.request = socket
@@ -229,7 +528,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
     def get_user_details(self):
         # Get name and password
 
-        data = read_from_socket(self.request)           
+        data = self.reader.read()
 
         if data is None:
 
@@ -237,29 +536,14 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
             raise ValueError
 
-        else:
-
-            username = data[0]
-            password = data[1]
-            lang_id  = data[2]
-
-            if not self.server.authenticate(password):
-
-                raise LoginError("Failed Login - Incorrect password.")
-
-            elif not self.server.check_lang_id(lang_id):
-
-                raise LoginError("Failed Login - Incorrect interpreter. Please use '{}' to connect to the server.".format(self.server.app.lang.get_name()))
-
-        self.name    = username
-        self.user_id = self.server.add_new_client(self.client_address, self.request, self.name)
+        self.user_id, self.name = self.server.login(data, self.client_address, self.request)
 
         return self.user_id, self.name
 
     def handle(self):
         """ Overload """
 
-        print(self.server, self.server, self.server is self.server)
+        self.reader = FrameReader(self.request)
 
         try:
 
@@ -289,7 +573,15 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
         while True:
 
-            data = read_from_socket(self.request)           
+            try:
+
+                data = self.reader.read()
+
+            except FrameError as err:
+
+                print("Invalid data from {} - {}".format(self.client_address, err))
+
+                data = None
 
             if data is None:
 
@@ -315,38 +607,11 @@ class RequestHandler(socketserver.BaseRequestHandler):
     def handle_new_connection(self):
         """ Called during a connection, updates connected clients with name information
             and resets the seed for random number generation etc.  """
-
-        # Send the user_id to the client
-
-        self.send([HANDLE_SET_ID, self.user_id])
-
-        # Notify other users
-
-        self.send_to_all( MESSAGE_NAME(self.user_id, self.name) )
-
-        # Rest the seed
-
-        self.send( MESSAGE_SEED(seed=self.server.get_seed()) )
-
-        # Grab current code
-
-        self.pull_all_code()
-
-        return
+        return self.server.handle_new_connection(self.user_id, self.name)
 
     def pull_all_code(self):
         """ Sends all current codelet data to the client """
-        # Get all the connected users
-        for id_num, user in list(self.server.users.items()):
-            if id_num != self.get_user_id():
-                self.send(MESSAGE_NAME(id_num, user.get_name()))
-
-        # Get all the code
-        for codelet in self.server.app.get_codelets():
-            data = MESSAGE_HISTORY(-1, codelet.get_id(), codelet.get_history(), codelet.get_order_id(), codelet.is_hidden())
-            self.send(data)
-
-        return
+        return self.server.pull_all_code(self.user_id)
 
     def send(self, data):
         """ Sends the data to THIS connected client """
@@ -355,11 +620,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
     def send_to_all(self, data):
         """ Forwards 'data' to all connected clients """
-
-        for socket in self.server.connections():
-
-            send_to_socket(socket, data)
-
+        self.server.send_to_all(data)
         return
 
     def get_user_id(self):
@@ -373,20 +634,130 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
 
 class Client:
-    """ Keeps track of information on connected clients """
-    def __init__(self, id_num, address, socket, name):
+    """ Keeps track of information on connected clients. Messages are added to a
+        bounded outbound queue that is drained by a writer thread so that a slow
+        client cannot block the rest of the server """
+    queue_full = queue.Full
+    def __init__(self, id_num, address, socket, name, queue_size=1024, overflow_policy=OVERFLOW_DROP):
         self.address = address
         self.host = self.address[0]
         self.port = self.address[1]
 
-        self.socket  = socket
         self.id      = id_num
         self.name    = name
 
-        self.connected = True
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+
+        self.outbox  = None
+        self.writer  = None
+        self.dropped = 0
+        self.dropped_lock = Lock() # Messages can be dropped from any thread that sends
+
+        self.socket    = None
+        self.connected = False
+
+        if socket is not None:
+
+            self.connect(socket)
 
     def send(self, data):
-        return send_to_socket(self.socket, data)
+        return self.send_bytes(encode_message(data), data[0] in EPHEMERAL_MESSAGES)
+
+    def send_bytes(self, packet, ephemeral=False):
+        """ Sends an already encoded message to this client """
+        return self.enqueue(packet, ephemeral)
+
+    def enqueue(self, packet, ephemeral=False):
+        """ Adds an already encoded message to the outbound queue. Returns
+            False if the message was dropped """
+
+        outbox = self.outbox
+
+        if not self.connected or outbox is None:
+
+            return False
+
+        # Ephemeral messages are dropped before the queue is full to leave room for the rest
+
+        if ephemeral and self.overflow_policy == OVERFLOW_DROP and outbox.qsize() >= self.queue_size // 2:
+
+            self.add_dropped()
+
+            return False
+
+        try:
+
+            outbox.put_nowait(packet)
+
+        except self.queue_full:
+
+            self.add_dropped()
+
+            print("Client '{}' is not keeping up - disconnecting".format(self.name))
+
+            self.connected = False
+
+            self.close_connection()
+
+            return False
+
+        return True
+
+    def write_loop(self, sock, outbox):
+        """ Sends queued messages to the socket until the sentinel value (None) is received """
+        while True:
+            packet = outbox.get()
+            if packet is None:
+                break
+            try:
+                send_bytes_to_socket(sock, packet)
+            except OSError:
+                break
+        return
+
+    def start_writer(self):
+        """ Creates a new outbound queue and writer thread for the current socket """
+        self.outbox = queue.Queue(self.queue_size)
+        self.writer = Thread(target=self.write_loop, args=(self.socket, self.outbox))
+        self.writer.daemon = True
+        self.writer.start()
+        return
+
+    def stop_writer(self, timeout=None):
+        """ Stops the writer thread once it has sent any queued messages """
+        outbox, writer = self.outbox, self.writer
+        self.outbox = None
+        if outbox is not None:
+            try:
+                outbox.put_nowait(None)
+            except self.queue_full:
+                pass # The writer stops when the socket is closed
+        if writer is not None and timeout is not None:
+            writer.join(timeout)
+        return
+
+    def close_connection(self):
+        """ Shuts down the socket, the request handler then removes the client from the server """
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return
+
+    def get_queue_depth(self):
+        """ Returns the number of messages waiting to be sent to this client """
+        outbox = self.outbox
+        return outbox.qsize() if outbox is not None else 0
+
+    def add_dropped(self):
+        with self.dropped_lock:
+            self.dropped += 1
+        return
+
+    def get_dropped(self):
+        """ Returns the number of messages dropped for this client since the server started """
+        return self.dropped
 
     def get_id(self):
         return self.id
@@ -394,10 +765,21 @@ class Client:
     def connect(self, new_socket):
         self.socket    = new_socket
         self.connected = True
+        self.set_no_delay()
+        self.start_writer()
         return self
 
+    def set_no_delay(self):
+        """ Disables Nagle's algorithm so small messages e.g. lock grants are sent immediately """
+        try:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        return
+
     def disconnect(self):
         self.connected = False
+        self.stop_writer()
         return
 
     def update_address(self, new_address):
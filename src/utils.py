@@ -1,4 +1,4 @@
-import sys, json
+import sys, json, struct
 import os.path
 from socket import error as socket_error
 
@@ -41,6 +41,7 @@ SERVER_PORT_NUMER = 57890
 
 BOOT_DIR = os.path.join(os.path.dirname(__file__), "boot")
 TIDAL_BOOT_FILE = os.path.join(BOOT_DIR, "tidal.boot") 
+STUB_REPL_FILE = os.path.join(BOOT_DIR, "stub_repl.py")
 # App Types
 
 class APP_TYPES:
@@ -63,7 +64,7 @@ HANDLE_UPDATE   = 10
 HANDLE_ERROR    = 11
 HANDLE_INFO     = 12
 HANDLE_REMOVE   = 13
-HANDLE_HISTORY  = 14
+# 14 was HANDLE_HISTORY, replaced by HANDLE_SNAPSHOT
 HANDLE_HIDE     = 15
 HANDLE_SHUTDOWN = 16
 HANDLE_SEED     = 17
@@ -75,6 +76,8 @@ HANDLE_MONITOR_START = 21
 HANDLE_MONITOR_STOP  = 22
 HANDLE_MONITOR_EVAL  = 23
 
+HANDLE_SNAPSHOT = 24
+
 # user_id is always source
 
 def MESSAGE_KILL(user_id):
@@ -117,8 +120,10 @@ def MESSAGE_REMOVE(user_id):
     """ Removes a user from the application """
     return [HANDLE_REMOVE, user_id]
 
-def MESSAGE_HISTORY(user_id, codelet_id, data, order_id, hidden=0):
-    return [HANDLE_HISTORY, user_id, codelet_id, data, order_id, int(hidden)]
+def MESSAGE_SNAPSHOT(user_id, codelets):
+    """ All current codelets for a new client, each as [codelet_id, history, order_id, hidden]
+        where history is in the compact form returned by Codelet.pack_history """
+    return [HANDLE_SNAPSHOT, user_id, codelets]
 
 def MESSAGE_UNDO(user_id, codelet_id):
     return [HANDLE_UNDO, user_id, codelet_id]
@@ -156,50 +161,101 @@ NULL = -1
 
 # Class and functions for creating and sending messages to the server/clients
 
+# Each frame is a 4 byte unsigned (network order) length followed by the JSON payload
+
+FRAME_HEADER   = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024 # 16MB
+
+class FrameError(ValueError):
+    """ Raised when a frame is malformed or larger than MAX_FRAME_SIZE """
+    pass
+
 class Message:
     """ Wrapper for JSON messages sent to the server """
     def __init__(self, data):
         self.data = data
     def __str__(self):
-        """ Prepares the json message to be sent with first 4 digits
-            denoting the length of the message """
-        packet = str(json.dumps(self.data, separators=(',',':')))
-        length = "{:04d}".format( len(packet) )
-        return length + packet
+        """ Returns the JSON payload of the message """
+        return json.dumps(self.data, separators=(',',':'))
     def __len__(self):
-        return len(str(self))
+        return len(self.as_bytes())
     def as_string(self):
         return str(self)
     def as_bytes(self):
-        return str(self).encode("utf-8")
+        """ Returns the payload prefixed with a binary length header """
+        payload = str(self).encode("utf-8")
+        if len(payload) > MAX_FRAME_SIZE:
+            raise FrameError("Message of {} bytes exceeds the maximum frame size".format(len(payload)))
+        return FRAME_HEADER.pack(len(payload)) + payload
 
 def bytes_to_str(data):
-    return data.decode("utf-8") if type(data) is bytes else str(data)
+    return data.decode("utf-8") if type(data) in (bytes, bytearray) else str(data)
 
-def read_from_socket(sock):
-    """ Reads data from the socket """
-    # Get number single int that tells us how many digits to read
+def decode_frame_header(header, max_size=MAX_FRAME_SIZE):
+    """ Returns the payload length stored in a frame header """
+    size, = FRAME_HEADER.unpack(header)
+    if size > max_size:
+        raise FrameError("Frame of {} bytes exceeds the maximum frame size".format(size))
+    return size
+
+def decode_frame(payload):
+    """ Converts a frame payload back to a Python data structure """
     try:
-        bits = int(sock.recv(4))
-        if bits > 0:
-            # Read the remaining data (JSON)
-            data = sock.recv(bits)
-            # Convert back to Python data structure
-            return json.loads(bytes_to_str(data))
-    except (ConnectionAbortedError, ConnectionResetError):
-        return None
+        return json.loads(bytes_to_str(payload))
+    except ValueError as e: # UnicodeDecodeError or JSONDecodeError
+        raise FrameError(str(e))
+
+class FrameReader:
+    """ Buffered reader that returns complete frames from a socket, looping
+        on `recv` until the whole frame has arrived """
+    def __init__(self, sock, max_size=MAX_FRAME_SIZE, chunk_size=4096):
+        self.socket = sock
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def read(self):
+        """ Returns the next message or None if the connection was closed """
+        header = self.read_exactly(FRAME_HEADER.size)
+        if header is None:
+            return None
+        size = decode_frame_header(header, self.max_size)
+        payload = self.read_exactly(size)
+        if payload is None:
+            return None
+        return decode_frame(payload)
+
+    def read_exactly(self, num_bytes):
+        """ Returns exactly `num_bytes` from the socket or None if the connection closes first """
+        while len(self.buffer) < num_bytes:
+            try:
+                chunk = self.socket.recv(max(self.chunk_size, num_bytes - len(self.buffer)))
+            except (ConnectionAbortedError, ConnectionResetError):
+                return None
+            if not chunk:
+                return None
+            self.buffer.extend(chunk)
+        data = bytes(self.buffer[:num_bytes])
+        del self.buffer[:num_bytes]
+        return data
+
+def encode_message(data):
+    """ Serialises a message once and returns it as an immutable buffer that
+        can be sent to any number of sockets """
+    return memoryview(Message(data).as_bytes())
+
+def read_from_socket(sock):
+    """ Reads a single message from the socket without reading past the end of the frame """
+    return FrameReader(sock, chunk_size=0).read()
 
 def send_to_socket(sock, data):
     """ Converts Python data structure to JSON message and
         sends to a connected socket """
-    msg = Message(data)
-    # Get length and store as string
-    msg_len, msg_str = len(msg), msg.as_bytes()
-    # Continually send until we know all of the data has been sent
-    sent = 0
-    while sent < msg_len:
-        bits = sock.send(msg_str[sent:])
-        sent += bits
+    return send_bytes_to_socket(sock, Message(data).as_bytes())
+
+def send_bytes_to_socket(sock, packet):
+    """ Sends an already encoded message to a connected socket """
+    sock.sendall(packet)
     return
 
 # Codelet colour information
@@ -0,0 +1,38 @@
+""" Checks that every message sent to a slow client is either queued or counted as
+    dropped when many threads send to it at once """
+
+import queue
+import threading
+
+from src.server.server import Client
+from src.utils import *
+
+def test_dropped_messages_are_counted_from_many_threads():
+
+    client = Client(1, ("localhost", 0), None, "slow", queue_size=64)
+
+    # Connected with no writer thread, so nothing leaves the queue
+
+    client.outbox = queue.Queue(client.queue_size)
+    client.connected = True
+
+    threads, count = 8, 5000
+
+    accepted = []
+
+    def send():
+        n = 0
+        for _ in range(count):
+            n += client.send(MESSAGE_TYPING(1, 1))
+        accepted.append(n)
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    assert sum(accepted) == client.get_queue_depth()
+    assert client.get_dropped() == threads * count - sum(accepted)
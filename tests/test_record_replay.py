@@ -0,0 +1,140 @@
+""" Records a session in which a client disconnects while editing a codelet and checks
+    that replaying it leaves the codelet, and the users, in the same state """
+
+import socket
+import threading
+import time
+
+from hashlib import md5
+
+import pytest
+
+import src.server.server as server_module
+
+from src.interpreter import Stub
+from src.server import Server, AsyncServer, ReplayServer
+from src.server.recorder import SessionReader
+from src.utils import *
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class Performer:
+    """ Logs in to the server and keeps the messages it receives """
+    def __init__(self, port, name):
+        self.socket = socket.create_connection(("127.0.0.1", port))
+        self.reader = FrameReader(self.socket)
+        self.received = []
+        self.user_id = None
+        send_to_socket(self.socket, [name, md5(b"").hexdigest(), Stub.ident])
+        self.listener = threading.Thread(target=self.listen, daemon=True)
+        self.listener.start()
+
+    def listen(self):
+        try:
+            while True:
+                data = self.reader.read()
+                if data is None:
+                    break
+                if data[0] == HANDLE_SET_ID:
+                    self.user_id = data[1]
+                self.received.append(data)
+        except (OSError, ValueError):
+            pass
+        return
+
+    def send(self, data):
+        send_to_socket(self.socket, data)
+        return
+
+    def close(self):
+        self.socket.shutdown(socket.SHUT_RDWR)
+        self.socket.close()
+        return
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+    return
+
+def get_state(app):
+    return sorted((codelet.get_id(), codelet.get_text(), codelet.get_editor()) for codelet in app.get_codelets())
+
+@pytest.fixture(params=[Server, AsyncServer])
+def server(request, monkeypatch, tmp_path):
+    monkeypatch.setattr(server_module, "getpass", lambda prompt: "")
+    monkeypatch.setattr(server_module, "SERVER_PORT_NUMER", get_free_port())
+    server = request.param(interpreter=Stub, visible=False, record=str(tmp_path / "session.rec.gz"))
+    server.app.lang.start_server()
+    server.running = True
+    server.start_engine()
+    threading.Thread(target=server.app.run, daemon=True).start()
+    yield server
+    if server.running:
+        server.kill()
+
+def test_disconnect_while_editing_is_replayed(server, tmp_path):
+
+    alice = Performer(server.port, "alice")
+    bob   = Performer(server.port, "bob")
+
+    wait_for(lambda: alice.user_id is not None and bob.user_id is not None)
+
+    alice.send(MESSAGE_PUSH(alice.user_id, -1, "first"))
+    alice.send(MESSAGE_PUSH(alice.user_id, -1, "second"))
+
+    wait_for(lambda: len(server.app.get_codelets()) == 2)
+
+    codelet_id = min(codelet.get_id() for codelet in server.app.get_codelets())
+
+    bob.send(MESSAGE_REQUEST(bob.user_id, codelet_id))
+
+    wait_for(lambda: server.app.get_codelet(codelet_id).get_editor() == bob.user_id)
+
+    # Bob disconnects while holding the lock on the codelet
+
+    bob.close()
+
+    wait_for(lambda: not server.app.get_codelet(codelet_id).is_being_edited())
+
+    wait_for(lambda: bob.user_id not in server.users)
+
+    # Alice is told about the codelet being released and Bob leaving
+
+    wait_for(lambda: [HANDLE_REMOVE, bob.user_id] in alice.received)
+
+    assert MESSAGE_RELEASE(bob.user_id, codelet_id) in alice.received
+
+    alice.close()
+
+    wait_for(lambda: alice.user_id not in server.users)
+
+    live_state = get_state(server.app)
+    live_users = sorted(server.users)
+
+    server.kill()
+
+    path = str(tmp_path / "session.rec.gz")
+
+    assert [MESSAGE_REMOVE(bob.user_id)] in [args for t, kind, args in SessionReader(path) if kind == "message"]
+
+    replay = ReplayServer(interpreter=Stub)
+
+    try:
+
+        replay.replay(path, speed=0)
+
+        assert get_state(replay.app) == live_state
+
+        assert all(editor is None for _, _, editor in get_state(replay.app))
+
+        assert sorted(replay.users) == live_users
+
+    finally:
+
+        replay.kill()
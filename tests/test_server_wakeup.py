@@ -0,0 +1,63 @@
+""" Measures how long a message waits in the server queue before the GUI server handles
+    it. Uses a Tcl interpreter, which needs no display, in place of the Tk root """
+
+import threading
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+tkinter = pytest.importorskip("tkinter")
+
+from src.app.frames import FrameScheduler
+from src.app.server_app import ServerApp
+from src.server.dispatch import MessageQueue
+
+def make_app(root, fps):
+    """ Returns a ServerApp with just the parts used to wake up and handle messages """
+    app = ServerApp.__new__(ServerApp)
+    app.handled = []
+    app.handle_data = app.handled.append
+    app.sharedspace = SimpleNamespace(frames=FrameScheduler(root, fps=fps))
+    app.socket = SimpleNamespace(queue=MessageQueue(),
+                                 record_message=lambda timestamp, data: None,
+                                 save_snapshot=lambda: None)
+    app.socket.queue.set_wakeup(app.wake)
+    return app
+
+def test_messages_are_handled_without_waiting_for_a_frame():
+
+    root = tkinter.Tcl()
+
+    # One frame per second, so anything waiting for a frame would take up to 1000ms
+
+    app = make_app(root, fps=1)
+
+    if app.sharedspace.frames.wakeup_pipe is None:
+
+        pytest.skip("Wakeup pipe not supported on this platform")
+
+    count, done = 100, []
+
+    def produce():
+        time.sleep(0.1)
+        for n in range(count):
+            app.socket.queue.put([n])
+            time.sleep(0.002)
+        done.append(True)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    deadline = time.time() + 10
+
+    while len(app.handled) < count and time.time() < deadline:
+
+        root.tk.dooneevent(0)
+
+    app.sharedspace.frames.close()
+
+    latency = app.socket.queue.latency
+
+    assert len(app.handled) == count
+    assert latency.percentile(99) < 0.1, str(latency)